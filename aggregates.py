@@ -0,0 +1,87 @@
+"""Dashboard aggregates kept up to date as reports change.
+
+``ReportAggregates`` is a store listener (see ``report_store``): it is rebuilt
+from every report once when registered, then each insert, status change or
+delete adjusts the counters by the difference between the old and new report.
+The dashboard reads KPIs and chart data from here instead of rescanning the
+reports on every rerun.
+"""
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+
+STATUS_DONE = "เสร็จสิ้น"
+
+
+def _day(report):
+    # report['date'] = "YYYY-MM-DD HH:MM"
+    return (report.get('date') or '')[:10]
+
+
+class ReportAggregates:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.total = 0
+        self._status = Counter()
+        self._severity = Counter()
+        self._classes = Counter()
+        self._daily_reports = Counter()
+        self._daily_items = Counter()
+        self._daily_done = Counter()
+
+    def _add(self, report, sign):
+        self.total += sign
+        self._status[report['status']] += sign
+        self._severity[report['severity']] += sign
+        for name, n in (report.get('details') or {}).items():
+            self._classes[name] += sign * n
+        day = _day(report)
+        self._daily_reports[day] += sign
+        self._daily_items[day] += sign * (report.get('count') or 0)
+        if report['status'] == STATUS_DONE:
+            self._daily_done[day] += sign
+
+    # --- store listener ---
+    def rebuild(self, reports):
+        with self._lock:
+            self._reset()
+            for report in reports:
+                self._add(report, 1)
+
+    def apply(self, old, new):
+        with self._lock:
+            if old is not None:
+                self._add(old, -1)
+            if new is not None:
+                self._add(new, 1)
+
+    # --- reads (copies; safe to keep) ---
+    def status_counts(self):
+        with self._lock:
+            return {k: v for k, v in self._status.items() if v}
+
+    def severity_counts(self):
+        with self._lock:
+            return {k: v for k, v in self._severity.items() if v}
+
+    def class_totals(self):
+        """Objects detected per class over all reports, most common first."""
+        with self._lock:
+            return {k: v for k, v in self._classes.most_common() if v}
+
+    def daily(self, days=30, today=None):
+        """``[(day, reports, items, done)]`` for the last ``days`` days, oldest first.
+
+        Days without reports are included with zeros so the series can be
+        charted directly; ``done`` counts reports from that day now marked done.
+        """
+        today = today or datetime.now()
+        series = []
+        with self._lock:
+            for offset in range(days - 1, -1, -1):
+                day = (today - timedelta(days=offset)).strftime("%Y-%m-%d")
+                series.append((day, self._daily_reports[day], self._daily_items[day], self._daily_done[day]))
+        return series
@@ -1,22 +1,29 @@
+import time
+imports_started = time.perf_counter()
 import streamlit as st
-from ultralytics import YOLO
 import PIL.Image
+import PIL.ImageOps
 import os
-import folium
-from streamlit_folium import st_folium
 from datetime import datetime
-from collections import Counter
-import time
-import pandas as pd
-import json
 import shutil
-import random
-from folium.plugins import MarkerCluster, HeatMap
+import metrics
+from report_store import PAGE_ORDERS, open_store
+# inference ไม่ import ultralytics จนกว่าจะโหลดโมเดล (ใน thread ของ worker)
+from inference import load_yolo, model_tag, DEFAULT_BATCH_SIZE, DEFAULT_CONF, MODEL_BACKEND, MODEL_INT8
+from inference_queue import InferenceQueue, QueueFull
+from submission import submit_photo, IMG_DIR
+from result_cache import ResultCache, image_digest
+from images import annotated_path, ensure_thumbnail, remove_image_files, save_annotated
+from aggregates import ReportAggregates
+from geo import SpatialIndex
+# folium / streamlit_folium / pandas / maps / export ถูก import เฉพาะหน้าที่ใช้ (ดู Main Page Router)
+imports_seconds = time.perf_counter() - imports_started
 
 # ---------------------------------------------------------
 # 1. ตั้งค่าหน้าเว็บ & CSS (Theme: Clean & Professional)
 # ---------------------------------------------------------
 st.set_page_config(page_title="Water Waste Manager", page_icon="🌊", layout="wide")
+rerun_started = time.perf_counter()
 
 st.markdown("""
 <style>
@@ -30,8 +37,24 @@ st.markdown("""
 
 # --- ตัวแปรระบบ ---
 DB_FILE = 'data_reports.json'
-IMG_DIR = 'uploaded_images'
+STORE_BACKEND = os.environ.get("REPORT_STORE", "json")  # "json" หรือ "sqlite"
 MODEL_VERSION = "YOLOv8n-Custom v8.0 (Ultimate)"
+INFERENCE_WORKERS = int(os.environ.get("INFERENCE_WORKERS", "1"))
+INFERENCE_MAX_PENDING = int(os.environ.get("INFERENCE_MAX_PENDING", "16"))
+# Prometheus: เปิด /metrics ที่ port นี้ และ/หรือ เขียนไฟล์ให้ node_exporter (textfile collector)
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0")) or None
+METRICS_FILE = os.environ.get("METRICS_FILE")
+# โหลดโมเดล + warm-up ใน thread พื้นหลังตั้งแต่ process เริ่ม (0 = รอจนมีคนใช้หน้าประชาชน)
+INFERENCE_PRELOAD = os.environ.get("INFERENCE_PRELOAD", "1") == "1"
+
+# เวลาเริ่มระบบ: นับครั้งเดียวต่อ process (รอบแรก import โมดูลจริง รอบต่อไปได้จาก cache)
+# ขึ้นต้นด้วย _ = cache_resource ไม่เอาค่านี้ไป hash จึงเก็บเฉพาะค่าของรอบแรก (cold start)
+@st.cache_resource
+def startup_times(_first_imports_seconds):
+    metrics.observe("startup_imports", _first_imports_seconds)
+    return {"imports_s": _first_imports_seconds, "process_started": time.time()}
+
+startup = startup_times(imports_seconds)
 
 if not os.path.exists(IMG_DIR):
     os.makedirs(IMG_DIR)
@@ -39,45 +62,150 @@ if not os.path.exists(IMG_DIR):
 # ---------------------------------------------------------
 # 2. ฟังก์ชันจัดการข้อมูล (Data Management)
 # ---------------------------------------------------------
+# json: snapshot + journal (append-only) | sqlite: ตารางมี index สำหรับกรอง/นับ/ค้นหา ID
+# store ตัวเดียวใช้ร่วมกันทุก session ใน process (ไม่ต้องโหลดข้อมูลซ้ำต่อ session)
+@st.cache_resource
+def get_store():
+    return open_store(STORE_BACKEND, DB_FILE)
+
+store = get_store()
+# ดึงเฉพาะส่วนที่ process อื่นเขียนเพิ่ม (เช็ค version/ขนาด journal ซึ่งถูกมาก)
+with metrics.timer("data_load"):
+    store.refresh()
+
+# index ตำแหน่งรายงาน (grid) อัปเดตตามการเขียนของ store ใช้รวมรายงานใกล้กันเป็นเหตุการณ์เดียว
+@st.cache_resource
+def get_spatial_index():
+    index = SpatialIndex()
+    store.add_listener(index)
+    return index
+
+spatial_index = get_spatial_index()
+
+# ตัวเลข KPI/กราฟ ปรับทีละรายการตอนเพิ่ม/แก้/ลบ ไม่ต้องนับใหม่ทุกรอบ
+@st.cache_resource
+def get_aggregates():
+    aggregates = ReportAggregates()
+    store.add_listener(aggregates)
+    return aggregates
+
+aggregates = get_aggregates()
+
 def load_data():
-    if os.path.exists(DB_FILE):
-        with open(DB_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return []
-
-def save_data():
-    with open(DB_FILE, 'w', encoding='utf-8') as f:
-        json.dump(st.session_state['reports'], f, ensure_ascii=False, indent=4)
-
-def delete_report(report_index):
-    report = st.session_state['reports'][report_index]
-    if report.get('image_path') and os.path.exists(report['image_path']):
-        os.remove(report['image_path'])
-    st.session_state['reports'].pop(report_index)
-    save_data()
+    return store.load()
+
+def save_data(report):
+    with metrics.timer("save"):
+        store.put(report)
+
+def delete_report(report_id):
+    report = store.get(report_id)
+    if report is None:
+        return
+    if report.get('image_path'):
+        remove_image_files(report['image_path'])
+    store.delete(report_id)
+    result_cache.unregister(report_id)
+    # ลบรายงานหลักของเหตุการณ์: ให้รายงานถัดไปในกลุ่มเป็นรายงานหลักแทน
+    members = store.incident_members(report_id)
+    for member in members:
+        save_data(dict(member, incident_id=members[0]['id']))
+
+def update_status(report, status):
+    """Set ``status`` on a report and, for an incident's primary report, on every merged report."""
+    save_data(dict(report, status=status))
+    if report.get('incident_id', report['id']) == report['id']:
+        for member in store.incident_members(report['id']):
+            save_data(dict(member, status=status))
 
 # ---------------------------------------------------------
 # 3. Session State & Model Init
 # ---------------------------------------------------------
-if 'reports' not in st.session_state:
-    st.session_state['reports'] = load_data()
-
 if 'logged_in' not in st.session_state:
     st.session_state['logged_in'] = False
 
+# ผล AI จำไว้ตาม hash ของรูป (+ confidence + รุ่นโมเดล) กดวิเคราะห์ซ้ำไม่ต้องรันโมเดลใหม่
 @st.cache_resource
-def load_model():
-    model_path = "best.pt"
-    if os.path.exists(model_path):
-        return YOLO(model_path)
-    else:
-        return YOLO("yolov8n.pt") 
+def get_result_cache():
+    return ResultCache(model_tag=model_tag())
+
+result_cache = get_result_cache()
+
+# worker แต่ละตัวถือโมเดลของตัวเอง (โหลด + warm-up ใน thread ของ worker ไม่บล็อกหน้าเว็บ)
+# session แค่ส่งงานเข้าคิวแล้วคอยดูผล
+@st.cache_resource
+def get_inference_queue():
+    queue = InferenceQueue(load_yolo, workers=INFERENCE_WORKERS, max_pending=INFERENCE_MAX_PENDING, cache=result_cache)
+    metrics.gauge("inference_queue_depth", "Inference jobs waiting for a worker.", lambda: queue.depth)
+    metrics.gauge("inference_workers_busy", "Inference workers running a job.", lambda: queue.busy)
+    metrics.gauge("model_ready", "1 once every inference worker has loaded its model.", lambda: int(queue.ready))
+    metrics.gauge("model_load_seconds", "Queue start to all models loaded and warmed up.", lambda: queue.load_seconds)
+    return queue
 
-try:
-    model = load_model()
-except Exception as e:
-    st.error(f"Error loading model: {e}")
-    model = None
+# ---------------------------------------------------------
+# Page (หน้าไหน import อะไร / ต้องใช้โมเดลไหม ตัดสินจากตรงนี้)
+# ---------------------------------------------------------
+if st.session_state['logged_in']:
+    page = "Dashboard"
+else:
+    page = "Citizen"
+
+# หน้าเจ้าหน้าที่ไม่ต้องรอ/ไม่ต้องสร้างโมเดล เว้นแต่เปิด preload ไว้ (โหลดเบื้องหลังอยู่แล้ว)
+inference_queue = get_inference_queue() if INFERENCE_PRELOAD or page == "Citizen" else None
+if inference_queue is not None and inference_queue.load_error:
+    st.error(f"Error loading model: {inference_queue.load_error}")
+
+# ค่าที่อ่านสดตอน export (จำนวนงาน) + เปิด endpoint/ไฟล์ ครั้งเดียวต่อ process
+@st.cache_resource
+def start_metrics_export():
+    metrics.gauge("reports_total", "Reports in the store.", lambda: aggregates.total)
+    if METRICS_PORT:
+        metrics.REGISTRY.serve(METRICS_PORT)
+    if METRICS_FILE:
+        metrics.REGISTRY.write_every(METRICS_FILE)
+    return True
+
+start_metrics_export()
+
+def annotated_preview(report):
+    """``(path, job)`` for the AI-annotated image, created on first request (cache first, model if needed).
+
+    ``path`` is set once the image exists. Until then ``job`` is the queued model
+    run to poll (kept in session state across reruns), or ``None`` if the queue
+    is full.
+    """
+    path = annotated_path(report['image_path'])
+    if os.path.exists(path):
+        return path, None
+    # วาดที่ค่า conf เดียวกับตอนนับ (รายงานเก่าที่ไม่มี conf ใช้ค่าเริ่มต้น)
+    conf = report.get('conf', DEFAULT_CONF)
+    hit = result_cache.get(report['image_sha256'], conf) if report.get('image_sha256') else None
+    if hit and hit["plotted"] is not None:
+        return save_annotated(report['image_path'], hit["plotted"]), None
+    queue = get_inference_queue()
+    job_key = f"preview_job_{report['id']}"
+    job = queue.get(st.session_state[job_key]) if job_key in st.session_state else None
+    if job is None:
+        try:
+            job = queue.submit([PIL.Image.open(report['image_path'])], conf=conf, plot=True)
+        except QueueFull:
+            return None, None
+        st.session_state[job_key] = job.id
+    if job.status == "done":
+        del st.session_state[job_key]
+        return save_annotated(report['image_path'], job.results[0]["plotted"]), None
+    return None, job
+
+# จัดกลุ่มหมุดฝั่ง server: index สร้างใหม่เมื่อข้อมูล/ตัวกรองเปลี่ยน, ผลต่อ viewport จำไว้
+@st.cache_resource(max_entries=8)
+def get_cluster_index(version, statuses, severities, primary_only):
+    from maps import ClusterIndex
+    # primary_only ตรงกับรายการงาน: หนึ่งหมุดต่อหนึ่งเหตุการณ์
+    return ClusterIndex(store.query(statuses=list(statuses), severities=list(severities), primary_only=primary_only))
+
+@st.cache_data(max_entries=64)
+def get_clusters(version, statuses, severities, primary_only, zoom, bounds):
+    return get_cluster_index(version, statuses, severities, primary_only).query(zoom, bounds)
 
 def send_email_notification(to_email, job_id, status):
     if to_email:
@@ -89,18 +217,42 @@ def send_email_notification(to_email, job_id, status):
 # ---------------------------------------------------------
 st.sidebar.image("https://cdn-icons-png.flaticon.com/512/2964/2964514.png", width=60)
 st.sidebar.title("Smart River")
-st.sidebar.caption(f"System: {MODEL_VERSION}")
+st.sidebar.caption(f"System: {MODEL_VERSION} | {MODEL_BACKEND}{' INT8' if MODEL_INT8 else ''}")
 
 st.sidebar.markdown("---")
 
-# --- System Status (Fake but Cool) ---
+# --- System Status (ค่าจริงจาก metrics ของ process นี้) ---
 # [แก้แล้ว] เปลี่ยน expanded=True เพื่อให้กางออกตลอดเวลา
 with st.sidebar.expander("🖥️ สถานะเซิร์ฟเวอร์ (Server Status)", expanded=True):
     col_s1, col_s2 = st.columns(2)
-    col_s1.metric("API", "🟢 Online")
-    col_s2.metric("DB", "🟢 Connected")
-    # สุ่มค่า CPU ให้มันขยับๆ ดูมีชีวิตชีวา
-    st.progress(random.randint(20, 40), text="CPU Load")
+    if inference_queue is None:
+        col_s1.metric("AI", "💤 Standby")
+        col_s2.metric("คิว AI", 0)
+    else:
+        col_s1.metric("AI", "🔴 Error" if inference_queue.load_error
+                      else ("🟢 Online" if inference_queue.ready else "🟡 Loading"))
+        col_s2.metric("คิว AI", inference_queue.depth, help=f"กำลังประมวลผล {inference_queue.busy} งาน")
+    cpu = metrics.cpu_percent()
+    st.progress(min(100, int(cpu)), text=f"CPU {cpu:.0f}%")
+    memory = metrics.memory_mb()
+    if memory is not None:
+        st.caption(f"หน่วยความจำ {memory:.0f} MB")
+    if st.session_state['logged_in']:
+        # p50/p95 ของแต่ละช่วง (จากตัวอย่างล่าสุด)
+        rows = []
+        for phase, label in [("rerun", "Rerun"), ("data_load", "โหลดข้อมูล"), ("map_build", "สร้างแผนที่"),
+                             ("map_render", "แสดงแผนที่"), ("save", "บันทึก"),
+                             ("inference_queue_wait", "รอคิว AI"), ("inference_forward", "AI forward")]:
+            p50, p95, n = metrics.percentiles(phase)
+            if n:
+                rows.append({"ช่วง": label, "p50 (ms)": round(p50 * 1000, 1), "p95 (ms)": round(p95 * 1000, 1), "n": n})
+        if rows:
+            # ตาราง markdown: หน้า sidebar ไม่ต้อง import pandas
+            st.markdown("| ช่วง | p50 (ms) | p95 (ms) | n |\n|---|---:|---:|---:|\n" + "\n".join(
+                f"| {r['ช่วง']} | {r['p50 (ms)']} | {r['p95 (ms)']} | {r['n']} |" for r in rows))
+        ready_in = inference_queue.load_seconds if inference_queue is not None else None
+        st.caption(f"เริ่มระบบ: import {startup['imports_s']:.1f}s"
+                   + (f" | โมเดลพร้อมใน {ready_in:.1f}s" if ready_in is not None else ""))
     st.caption(f"Last heartbeat: {datetime.now().strftime('%H:%M:%S')}")
 
 # --- Hidden Admin Login ---
@@ -129,30 +281,29 @@ else:
         st.rerun()
         
 # ---------------------------------------------------------
-# 5. Main Page Router
+# 5. Main Page Router (page ถูกกำหนดไว้ตั้งแต่ตอนเตรียมโมเดลด้านบน)
 # ---------------------------------------------------------
-if st.session_state['logged_in']:
-    page = "Dashboard"
-else:
-    page = "Citizen"
 
 # =========================================================
 # 🏠 ส่วนที่ 1: หน้าประชาชน (Citizen View)
 # =========================================================
 if page == "Citizen":
+    with metrics.timer("page_imports"):
+        import folium
+        from streamlit_folium import st_folium
     
     st.title("🌊 แจ้งเหตุขยะในแหล่งน้ำ")
     st.markdown("**ร่วมเป็นส่วนหนึ่งในการดูแลแม่น้ำของเรา ง่ายๆ เพียง 3 ขั้นตอน**")
     
     # --- [NEW] Recent Feed (Social Proof) ---
-    if st.session_state['reports']:
+    last_report = store.latest()
+    if last_report:
         st.markdown("---")
         with st.container():
             col_feed, col_txt = st.columns([0.1, 0.9])
             with col_feed:
                 st.markdown("📢")
             with col_txt:
-                last_report = st.session_state['reports'][-1]
                 st.caption(f"**ล่าสุดเมื่อกี้:** มีเพื่อนพลเมืองแจ้งเหตุเข้ามาที่เขต {last_report.get('lat', 0):.2f}, {last_report.get('lon', 0):.2f} (งาน #{last_report['id']})")
 
     st.divider()
@@ -173,48 +324,78 @@ if page == "Citizen":
         st.subheader("1. หลักฐานรูปภาพ")
         
         # เลือกแหล่งภาพ
-        input_type = st.radio("เลือกวิธี:", ["📸 ถ่ายภาพ", "📂 อัปโหลด"], horizontal=True, label_visibility="collapsed")
+        input_type = st.radio("เลือกวิธี:", ["📸 ถ่ายภาพ", "📂 อัปโหลด", "🗂️ หลายภาพ"], horizontal=True, label_visibility="collapsed")
         
-        uploaded_file = None
+        uploaded_files = []
         if input_type == "📸 ถ่ายภาพ":
             uploaded_file = st.camera_input("กดปุ่มเพื่อถ่ายภาพ")
-        else:
+            uploaded_files = [uploaded_file] if uploaded_file else []
+        elif input_type == "📂 อัปโหลด":
             uploaded_file = st.file_uploader("เลือกไฟล์รูปภาพ", type=["jpg", "png", "jpeg"])
+            uploaded_files = [uploaded_file] if uploaded_file else []
+        else:
+            # ทีมลาดตระเวนส่งรูปจากรอบเดียวกันทีละหลายสิบรูป
+            uploaded_files = st.file_uploader("เลือกไฟล์รูปภาพ (หลายไฟล์)", type=["jpg", "png", "jpeg"], accept_multiple_files=True)
         
-        if uploaded_file:
-            image = PIL.Image.open(uploaded_file)
-            st.image(image, caption="ภาพตัวอย่าง", use_container_width=True)
+        if uploaded_files:
+            # หมุนตาม EXIF ก่อนเข้า AI ให้ตรงกับรูปที่บันทึก (ingest_image หมุนรูปต้นฉบับแบบเดียวกัน)
+            images = [PIL.ImageOps.exif_transpose(PIL.Image.open(f)) for f in uploaded_files]
+            digests = [image_digest(f.getvalue()) for f in uploaded_files]
+            if len(images) == 1:
+                st.image(images[0], caption="ภาพตัวอย่าง", use_container_width=True)
+            else:
+                st.image(images, width=120, caption=[f.name for f in uploaded_files])
             
             # AI Options
             with st.expander("⚙️ ตั้งค่า AI (ขั้นสูง)"):
                 conf_threshold = st.slider("ความละเอียด (Confidence)", 0.0, 1.0, 0.25, 0.05)
+                batch_size = st.number_input("จำนวนภาพต่อรอบ (Batch size)", 1, 64, DEFAULT_BATCH_SIZE)
+
+            if not inference_queue.ready:
+                # โมเดลยังโหลด/warm-up อยู่เบื้องหลัง: กดส่งได้เลย งานจะรอในคิว
+                st.caption("🤖 AI กำลังเตรียมพร้อม... ส่งภาพได้เลย ระบบจะเริ่มวิเคราะห์ทันทีที่พร้อม")
 
             if st.button("🔍 วิเคราะห์ด้วย AI", type="primary", use_container_width=True):
-                if model:
-                    # Progress Bar Simulation
-                    progress_text = "AI กำลังทำงาน..."
-                    my_bar = st.progress(0, text=progress_text)
-                    for percent in range(0, 101, 20):
-                        time.sleep(0.05)
-                        my_bar.progress(percent, text=progress_text)
-                    my_bar.empty()
-
-                    # Prediction
-                    results = model(image, conf=conf_threshold)
-                    res_plotted = results[0].plot()
-                    
-                    # Count Logic
-                    cls_indices = results[0].boxes.cls.tolist()
-                    names_dict = results[0].names
-                    counts_dict = Counter([names_dict[int(x)] for x in cls_indices])
-                    total_count = len(cls_indices)
-                    
-                    # Store in Session
-                    st.session_state['temp_img'] = res_plotted
-                    st.session_state['temp_count'] = total_count
-                    st.session_state['temp_details'] = dict(counts_dict)
-                    
-                    st.image(res_plotted, caption=f"ผลลัพธ์: พบ {total_count} ชิ้น", channels="BGR", use_container_width=True)
+                st.session_state.pop('temp_results', None)
+                try:
+                    job = inference_queue.submit(
+                        [img.copy() for img in images], conf=conf_threshold,
+                        batch_size=int(batch_size), plot=len(images) == 1,
+                        digests=digests)
+                    st.session_state['ai_job'] = job.id
+                except QueueFull:
+                    st.warning("⏳ ขณะนี้มีผู้ใช้ส่งภาพให้ AI จำนวนมาก กรุณาลองใหม่อีกครั้งในอีกสักครู่")
+
+            job = inference_queue.get(st.session_state['ai_job']) if 'ai_job' in st.session_state else None
+            if job and job.digests != digests:
+                # ผลนี้เป็นของรูปชุดก่อน (ผู้ใช้เปลี่ยนรูป) ต้องกดวิเคราะห์ใหม่
+                job = None
+            if job and not job.finished:
+                # poll เฉพาะส่วนนี้ ไม่ต้องรันทั้งหน้าใหม่ระหว่างรอ
+                @st.fragment(run_every=0.5)
+                def poll_ai_job():
+                    if job.finished:
+                        st.rerun()
+                    if job.status == "queued":
+                        st.progress(0, text=f"⏳ รอคิว AI (ก่อนหน้าคุณ {inference_queue.position(job)} งาน)")
+                    else:
+                        st.progress(job.progress, text=f"AI กำลังทำงาน... ({len(job.images or [])} ภาพ)")
+                    st.caption(f"งานในคิว: {inference_queue.depth} | กำลังประมวลผล: {inference_queue.busy}")
+
+                poll_ai_job()
+            elif job and job.status == "error":
+                st.error(f"ไม่พบโมเดล AI / วิเคราะห์ไม่สำเร็จ: {job.error}")
+            elif job:
+                # Store in Session (หนึ่งผลต่อหนึ่งภาพ เรียงตามไฟล์)
+                temp_results = [
+                    {"name": f.name, "count": r["count"], "details": r["details"], "plotted": r.get("plotted"),
+                     "conf": job.conf, "digest": digest}
+                    for f, r, digest in zip(uploaded_files, job.results, digests)]
+                st.session_state['temp_results'] = temp_results
+
+                if len(temp_results) == 1:
+                    total_count, counts_dict = temp_results[0]["count"], temp_results[0]["details"]
+                    st.image(job.results[0]["plotted"], caption=f"ผลลัพธ์: พบ {total_count} ชิ้น", use_container_width=True)
                     
                     if counts_dict:
                         items_str = ", ".join([f"{k} ({v})" for k,v in counts_dict.items()])
@@ -222,7 +403,10 @@ if page == "Citizen":
                     else:
                         st.warning("⚠️ ไม่พบวัตถุต้องสงสัย")
                 else:
-                    st.error("ไม่พบโมเดล AI")
+                    st.success(f"✅ วิเคราะห์ครบ {len(temp_results)} ภาพ พบรวม {sum(r['count'] for r in temp_results)} ชิ้น")
+                    st.dataframe(
+                        [{"ไฟล์": r["name"], "จำนวน": r["count"], "รายละเอียด": str(r["details"])} for r in temp_results],
+                        use_container_width=True)
 
     # --- Right Column: Map & Details ---
     with col_right:
@@ -230,7 +414,8 @@ if page == "Citizen":
         
         m = folium.Map(location=[13.7563, 100.5018], zoom_start=12)
         m.add_child(folium.LatLngPopup())
-        map_data = st_folium(m, height=300, use_container_width=True)
+        with metrics.timer("map_render"):
+            map_data = st_folium(m, height=300, use_container_width=True)
         
         lat, lon = 13.7563, 100.5018
         if map_data.get("last_clicked"):
@@ -270,46 +455,43 @@ if page == "Citizen":
     if btn_submit:
         if not confirm:
             st.toast("⚠️ กรุณายืนยันข้อมูลก่อนส่ง", icon="⚠️")
-        elif 'temp_count' not in st.session_state:
+        elif 'temp_results' not in st.session_state:
             st.toast("⚠️ กรุณาให้ AI ตรวจสอบรูปก่อน", icon="🤖")
+        elif ([r.get('digest') for r in st.session_state['temp_results']]
+              != [image_digest(f.getvalue()) for f in uploaded_files]):
+            st.toast("⚠️ รูปภาพเปลี่ยนไป กรุณาให้ AI ตรวจสอบใหม่", icon="🤖")
         else:
-            # Process Saving
-            new_id = len(st.session_state['reports']) + 1
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            
-            # File Handling
-            ext = "jpg"
-            if hasattr(uploaded_file, 'name') and uploaded_file.name != "camera_input":
-                ext = uploaded_file.name.split('.')[-1]
-            
-            save_path = f"{IMG_DIR}/report_{new_id}_{timestamp}.{ext}"
-            with open(save_path, "wb") as f:
-                f.write(uploaded_file.getbuffer())
-
-            severity = "🔴 วิกฤต" if st.session_state['temp_count'] > 10 else ("🟠 ปานกลาง" if st.session_state['temp_count'] > 5 else "🟢 เล็กน้อย")
-
-            new_report = {
-                "id": new_id,
-                "date": datetime.now().strftime("%Y-%m-%d %H:%M"),
-                "lat": lat, "lon": lon,
-                "count": st.session_state['temp_count'],
-                "details": st.session_state['temp_details'],
-                "severity": severity,
-                "note": final_note, # Smart Tag Data
-                "email": contact_email,
-                "status": "รอรับเรื่อง",
-                "image_path": save_path
-            }
-
-            st.session_state['reports'].append(new_report)
-            save_data()
+            # Process Saving (หนึ่งงานต่อหนึ่งภาพ)
+            new_ids = []
+            for f, result in zip(uploaded_files, st.session_state['temp_results']):
+                # รูปถูกหมุนตาม EXIF, ย่อ, บีบอัดเป็น JPEG และทำ thumbnail ตอนบันทึก
+                with metrics.timer("save"):
+                    new_report, duplicate = submit_photo(
+                        store, result_cache, f.getbuffer(), lat, lon,
+                        result['count'], result['details'],
+                        note=final_note,  # Smart Tag Data
+                        email=contact_email,
+                        annotated=result.get('plotted'),
+                        conf=result.get('conf'),
+                        # รวมกับเหตุการณ์ใกล้เคียงเฉพาะเมื่อผู้แจ้งระบุตำแหน่งบนแผนที่จริง
+                        spatial=spatial_index if map_data.get("last_clicked") else None)
+                if duplicate and duplicate[1] == "exact":
+                    st.info(f"📎 รูป {f.name} เคยถูกแจ้งแล้วในงาน #{duplicate[0]} (ไม่สร้างงานซ้ำ)")
+                elif duplicate:
+                    st.warning(f"🔁 รูป {f.name} คล้ายกับรูปในงาน #{duplicate[0]} เจ้าหน้าที่จะตรวจสอบให้")
+                if new_report.get('incident_id', new_report['id']) != new_report['id']:
+                    st.info(f"🔗 มีผู้แจ้งจุดนี้ไว้แล้ว รายงานของคุณถูกรวมกับงาน #{new_report['incident_id']}")
+                if new_report['id'] not in new_ids:
+                    new_ids.append(new_report['id'])
 
             st.balloons()
-            st.success(f"✅ บันทึกสำเร็จ! รหัสงานของคุณคือ: #{new_id}")
-            send_email_notification(contact_email, new_id, "ได้รับเรื่องแล้ว")
+            job_ids = ", ".join(f"#{i}" for i in new_ids)
+            st.success(f"✅ บันทึกสำเร็จ! รหัสงานของคุณคือ: {job_ids}")
+            send_email_notification(contact_email, job_ids, "ได้รับเรื่องแล้ว")
             
             # Reset
-            if 'temp_count' in st.session_state: del st.session_state['temp_count']
+            if 'temp_results' in st.session_state: del st.session_state['temp_results']
+            if 'ai_job' in st.session_state: del st.session_state['ai_job']
 
     # --- [NEW] Tracking System (ลดความระแวง) ---
     st.markdown("---")
@@ -323,28 +505,32 @@ if page == "Citizen":
             btn_track = st.button("ตรวจสอบ")
         
         if btn_track and track_id:
-            found = False
-            for r in st.session_state['reports']:
-                if str(r['id']) == track_id:
-                    st.info(f"🆔 งานหมายเลข: {r['id']}")
-                    st.write(f"📅 วันที่: {r['date']}")
-                    st.markdown(f"🚦 สถานะปัจจุบัน: **{r['status']}**")
-                    if r['status'] == "เสร็จสิ้น":
-                        st.success("🎉 ดำเนินการเรียบร้อยแล้ว!")
-                    found = True
-                    break
-            if not found:
+            r = store.get(int(track_id)) if track_id.strip().isdigit() else None
+            if r:
+                st.info(f"🆔 งานหมายเลข: {r['id']}")
+                st.write(f"📅 วันที่: {r['date']}")
+                st.markdown(f"🚦 สถานะปัจจุบัน: **{r['status']}**")
+                if r['status'] == "เสร็จสิ้น":
+                    st.success("🎉 ดำเนินการเรียบร้อยแล้ว!")
+            else:
                 st.error("❌ ไม่พบข้อมูล")
 
 # =========================================================
 # 👮 ส่วนที่ 2: หน้าเจ้าหน้าที่ (Dashboard View)
 # =========================================================
 elif page == "Dashboard":
+    with metrics.timer("page_imports"):
+        import folium
+        import pandas as pd
+        from streamlit_folium import st_folium
+        from export import EXPORT_FORMATS, export_reports
+        from maps import HEATMAP_ZOOM, heatmap_map, marker_layer, snap_bounds, viewport
     
     st.title("🔐 Agency Dashboard")
     st.caption("ระบบบริหารจัดการงานแจ้งเหตุ (Admin Only)")
     
-    if not st.session_state['reports']:
+    total_reports = aggregates.total
+    if not total_reports:
         st.warning("ยังไม่มีข้อมูลในระบบ")
     else:
         # --- Filters ---
@@ -355,15 +541,20 @@ elif page == "Dashboard":
             with f_col2:
                 severity_filter = st.multiselect("ระดับความรุนแรง", ["🔴 วิกฤต", "🟠 ปานกลาง", "🟢 เล็กน้อย"], default=["🔴 วิกฤต", "🟠 ปานกลาง", "🟢 เล็กน้อย"])
         
-        # Apply Filter
-        filtered_list = [r for r in st.session_state['reports'] if r['status'] in status_filter and r['severity'] in severity_filter]
+            # รายงานที่ถูกรวมเข้าเหตุการณ์อื่น ซ่อนไว้ใต้รายงานหลักเป็นค่าเริ่มต้น
+            show_merged = st.toggle("แสดงรายงานที่ถูกรวมแยกเป็นรายการ", value=False)
+        
+        # Apply Filter (นับอย่างเดียว รายการจริงโหลดทีละหน้าด้านล่าง)
+        filters = dict(statuses=status_filter, severities=severity_filter, primary_only=not show_merged)
+        filtered_total = store.count(**filters)
 
         # --- KPI Cards ---
+        status_counts = aggregates.status_counts()
         k1, k2, k3, k4 = st.columns(4)
-        k1.metric("ทั้งหมด", len(st.session_state['reports']))
-        k2.metric("รอรับเรื่อง", len([r for r in st.session_state['reports'] if r['status'] == 'รอรับเรื่อง']), delta_color="inverse")
-        k3.metric("ดำเนินการ", len([r for r in st.session_state['reports'] if r['status'] == 'กำลังดำเนินการ']))
-        k4.metric("เสร็จสิ้น", len([r for r in st.session_state['reports'] if r['status'] == 'เสร็จสิ้น']))
+        k1.metric("ทั้งหมด", total_reports)
+        k2.metric("รอรับเรื่อง", status_counts.get('รอรับเรื่อง', 0), delta_color="inverse")
+        k3.metric("ดำเนินการ", status_counts.get('กำลังดำเนินการ', 0))
+        k4.metric("เสร็จสิ้น", status_counts.get('เสร็จสิ้น', 0))
 
         st.divider()
 
@@ -375,89 +566,177 @@ elif page == "Dashboard":
             # Toggle Map Type
             is_heatmap = st.toggle("แสดงแบบ Heatmap (ความหนาแน่น)", value=False)
             
-            if filtered_list:
-                center_lat = filtered_list[-1]['lat']
-                center_lon = filtered_list[-1]['lon']
-                m_admin = folium.Map(location=[center_lat, center_lon], zoom_start=11)
+            if filtered_total:
+                # จุดกึ่งกลางจำไว้ต่อ session เพื่อให้แผนที่พื้นหลังไม่ต้อง render ใหม่ทุกครั้ง
+                if 'admin_map_center' not in st.session_state:
+                    newest = store.page(**filters, limit=1)[0]
+                    st.session_state['admin_map_center'] = [newest['lat'], newest['lon']]
+                center = st.session_state['admin_map_center']
+                filters_key = (store.version, tuple(status_filter), tuple(severity_filter), not show_merged)
                 
                 if is_heatmap:
-                    heat_data = [[r['lat'], r['lon']] for r in filtered_list]
-                    HeatMap(heat_data, radius=15).add_to(m_admin)
+                    with metrics.timer("map_build"):
+                        clusters = get_clusters(*filters_key, HEATMAP_ZOOM, None)
+                        heatmap = heatmap_map(clusters, center)
+                    with metrics.timer("map_render"):
+                        st_folium(heatmap, height=400, use_container_width=True,
+                                  returned_objects=[], key="admin_heatmap")
                 else:
-                    cluster = MarkerCluster().add_to(m_admin)
-                    for r in filtered_list:
-                        color = "red" if r['status'] == "รอรับเรื่อง" else ("orange" if r['status'] == "กำลังดำเนินการ" else "green")
-                        folium.Marker(
-                            [r['lat'], r['lon']],
-                            popup=f"#{r['id']} ({r['severity']})",
-                            icon=folium.Icon(color=color)
-                        ).add_to(cluster)
-                
-                st_folium(m_admin, height=400, use_container_width=True)
+                    # ส่งเฉพาะกลุ่มหมุดใน viewport ปัจจุบัน (ค่าจาก st_folium รอบก่อน)
+                    zoom, bounds = viewport(st.session_state.get('admin_map'))
+                    zoom = zoom or 11
+                    with metrics.timer("map_build"):
+                        clusters = get_clusters(*filters_key, zoom, snap_bounds(bounds, zoom))
+                        layer = marker_layer(clusters, zoom)
+                    with metrics.timer("map_render"):
+                        st_folium(folium.Map(location=center, zoom_start=11),
+                                  feature_group_to_add=layer,
+                                  height=400, use_container_width=True,
+                                  returned_objects=["bounds", "zoom"], key="admin_map")
             else:
                 st.info("ไม่มีข้อมูลตามตัวกรอง")
 
         with c_act:
             st.subheader("📥 จัดการข้อมูล")
-            # [NEW] CSV Export
-            df = pd.DataFrame(st.session_state['reports'])
-            if not df.empty:
-                # Cleanup for CSV
-                df['details'] = df['details'].astype(str) 
-                csv = df.to_csv(index=False).encode('utf-8')
-                
-                st.download_button(
-                    label="📄 ดาวน์โหลดรายงาน (Excel/CSV)",
-                    data=csv,
-                    file_name="waste_report.csv",
-                    mime="text/csv",
-                    type="primary",
-                    use_container_width=True
-                )
+            # [NEW] Export: สร้างไฟล์เมื่อกดเท่านั้น (ตามตัวกรอง) เขียนลงไฟล์ทีละช่วงจาก store
+            export_fmt = st.radio("รูปแบบไฟล์", list(EXPORT_FORMATS), horizontal=True,
+                                  format_func=lambda f: {"csv": "Excel/CSV", "parquet": "Parquet"}[f])
+            # ไฟล์ที่เตรียมไว้ใช้ได้จนกว่าตัวกรอง/รูปแบบจะเปลี่ยน (งานใหม่หลังจากนั้นไม่ทำให้ไฟล์หาย กดเตรียมใหม่เอง)
+            export_key = (tuple(status_filter), tuple(severity_filter), export_fmt)
+            if st.button("⚙️ เตรียมไฟล์รายงาน", use_container_width=True):
+                old = st.session_state.pop('export', None)
+                if old and os.path.exists(old[1]):
+                    os.remove(old[1])
+                with st.spinner("กำลังสร้างไฟล์..."):
+                    path = export_reports(store, export_fmt, statuses=status_filter, severities=severity_filter)
+                st.session_state['export'] = (export_key, path, datetime.now())
+
+            export = st.session_state.get('export')
+            if export and export[0] == export_key and os.path.exists(export[1]):
+                with open(export[1], 'rb') as f:
+                    st.download_button(
+                        label=f"📄 ดาวน์โหลดรายงาน ({export_fmt.upper()})",
+                        data=f,
+                        file_name=f"waste_report.{export_fmt}",
+                        mime=EXPORT_FORMATS[export_fmt],
+                        type="primary",
+                        use_container_width=True
+                    )
+                st.caption(f"สร้างเมื่อ {export[2].strftime('%H:%M:%S')} (ข้อมูลที่เข้ามาหลังจากนี้ กดเตรียมไฟล์ใหม่)")
             
             st.markdown("### 📊 กราฟสรุป")
-            if not df.empty:
-                st.caption("จำแนกตามความรุนแรง")
-                st.bar_chart(df['severity'].value_counts(), color="#ffaa00")
+            st.caption("จำแนกตามความรุนแรง")
+            st.bar_chart(pd.Series(aggregates.severity_counts()), color="#ffaa00")
+            class_totals = aggregates.class_totals()
+            if class_totals:
+                st.caption("ขยะที่ AI ตรวจพบ (ชิ้น) แยกตามประเภท")
+                st.bar_chart(pd.Series(class_totals), color="#1f77b4")
+
+        # --- Trends (จาก rollup รายวัน) ---
+        st.markdown("### 📈 แนวโน้ม 30 วันล่าสุด")
+        trend = pd.DataFrame(aggregates.daily(30), columns=["วันที่", "รายงาน", "ขยะ (ชิ้น)", "เสร็จสิ้น"])
+        trend = trend.set_index("วันที่")
+        t1, t2 = st.columns(2)
+        with t1:
+            st.caption("จำนวนรายงานต่อวัน / ที่เสร็จสิ้นแล้ว")
+            st.line_chart(trend[["รายงาน", "เสร็จสิ้น"]])
+        with t2:
+            st.caption("จำนวนขยะที่ตรวจพบต่อวัน")
+            st.area_chart(trend[["ขยะ (ชิ้น)"]], color="#ffaa00")
 
         # --- Task Management List ---
         st.divider()
         st.subheader("📝 รายการงาน (Task List)")
         
-        if filtered_list:
-            for r in filtered_list:
-                idx = st.session_state['reports'].index(r)
-                
+        # แบ่งหน้าฝั่ง store: แต่ละรอบโหลด/วาดเฉพาะงานในหน้าปัจจุบัน
+        c_sort, c_size, c_page = st.columns([2, 1, 1])
+        with c_sort:
+            sort_order = st.selectbox("เรียงตาม", PAGE_ORDERS, key="task_order", format_func=lambda o: {
+                "newest": "ใหม่สุด", "severity": "ความรุนแรง", "distance": "ใกล้กึ่งกลางแผนที่"}[o])
+        with c_size:
+            page_size = st.selectbox("ต่อหน้า", [10, 20, 50, 100], key="task_page_size")
+        page_count = max(1, -(-filtered_total // page_size))
+        with c_page:
+            page_no = st.number_input(f"หน้า (จาก {page_count})", min_value=1, max_value=page_count,
+                                      value=min(st.session_state.get('task_page', 1), page_count), step=1)
+            st.session_state['task_page'] = page_no
+
+        near = None
+        if sort_order == "distance":
+            zoom, bounds = viewport(st.session_state.get('admin_map'))
+            if bounds:
+                near = ((bounds[0] + bounds[2]) / 2, (bounds[1] + bounds[3]) / 2)
+            else:
+                near = tuple(st.session_state.get('admin_map_center', (13.7563, 100.5018)))
+        page_reports = store.page(**filters, order=sort_order, offset=(page_no - 1) * page_size,
+                                  limit=page_size, near=near)
+        
+        if page_reports:
+            st.caption(f"แสดง {(page_no - 1) * page_size + 1}-{(page_no - 1) * page_size + len(page_reports)} "
+                       f"จาก {filtered_total} งาน")
+            for r in page_reports:
                 # Card Styling
                 with st.expander(f"📌 งาน #{r['id']} | {r['status']} | {r['note'][:30]}..."):
                     c_img, c_info = st.columns([1, 2])
                     
                     with c_img:
-                        if os.path.exists(r['image_path']):
-                            st.image(r['image_path'], use_container_width=True)
-                        else:
+                        # ส่ง thumbnail เป็นค่าเริ่มต้น โหลดภาพเต็ม/ภาพผล AI เมื่อกดดูเท่านั้น
+                        thumb = ensure_thumbnail(r['image_path'])
+                        if thumb is None:
                             st.error("ไม่พบไฟล์ภาพ")
+                        else:
+                            view = st.radio("ภาพ", ["ย่อ", "ต้นฉบับ", "ผล AI"], horizontal=True,
+                                            key=f"v_{r['id']}", label_visibility="collapsed")
+                            if view == "ต้นฉบับ":
+                                st.image(r['image_path'], use_container_width=True)
+                            elif view == "ผล AI":
+                                preview, preview_job = annotated_preview(r)
+                                if preview:
+                                    st.image(preview, use_container_width=True)
+                                elif preview_job is None:
+                                    st.warning("AI ไม่ว่าง ลองใหม่อีกครั้ง")
+                                elif preview_job.status == "error":
+                                    st.error(f"สร้างภาพผล AI ไม่สำเร็จ: {preview_job.error}")
+                                else:
+                                    # poll เฉพาะการ์ดนี้จนงานเสร็จ (แบบเดียวกับหน้าประชาชน) ไม่บล็อกทั้งหน้า
+                                    @st.fragment(run_every=0.5)
+                                    def poll_preview_job(job=preview_job):
+                                        if job.finished:
+                                            st.rerun()
+                                        st.progress(job.progress, text="🤖 AI กำลังสร้างภาพผล...")
+
+                                    poll_preview_job()
+                            else:
+                                st.image(thumb, use_container_width=True)
                     
                     with c_info:
                         st.write(f"**วันที่:** {r['date']}")
                         st.write(f"**พิกัด:** {r['lat']}, {r['lon']}")
                         st.write(f"**รายละเอียด:** {r['note']}")
                         st.info(f"🤖 AI พบ: {r['count']} ชิ้น {r['details']}")
+                        if r.get('incident_id', r['id']) != r['id']:
+                            st.caption(f"🔗 รวมอยู่ในงาน #{r['incident_id']}")
+                        else:
+                            members = store.incident_members(r['id'])
+                            if members:
+                                st.caption(f"🔗 รวม {len(members) + 1} รายงาน: "
+                                           + ", ".join(f"#{m['id']}" for m in members))
                         
                         # Admin Actions
                         c_act1, c_act2 = st.columns(2)
                         with c_act1:
-                            new_status = st.selectbox("อัปเดตสถานะ", ["รอรับเรื่อง", "กำลังดำเนินการ", "เสร็จสิ้น"], index=["รอรับเรื่อง", "กำลังดำเนินการ", "เสร็จสิ้น"].index(r['status']), key=f"s_{idx}")
+                            new_status = st.selectbox("อัปเดตสถานะ", ["รอรับเรื่อง", "กำลังดำเนินการ", "เสร็จสิ้น"], index=["รอรับเรื่อง", "กำลังดำเนินการ", "เสร็จสิ้น"].index(r['status']), key=f"s_{r['id']}")
                             if new_status != r['status']:
-                                st.session_state['reports'][idx]['status'] = new_status
-                                save_data()
+                                update_status(r, new_status)
                                 st.rerun()
                         
                         with c_act2:
                             st.write("")
                             st.write("")
-                            if st.button("🗑️ ลบงานนี้", key=f"d_{idx}", type="primary"):
-                                delete_report(idx)
+                            if st.button("🗑️ ลบงานนี้", key=f"d_{r['id']}", type="primary"):
+                                delete_report(r['id'])
                                 st.rerun()
         else:
-            st.info("ไม่พบรายการ")
\ No newline at end of file
+            st.info("ไม่พบรายการ")
+
+metrics.observe("rerun", time.perf_counter() - rerun_started)
@@ -0,0 +1,104 @@
+"""Backfill or re-score report images offline with the same model as the app.
+
+    python backfill.py                        # fill reports that were never scored
+    python backfill.py --rescore              # re-score every report (e.g. after a model upgrade)
+    python backfill.py --dir patrol_0412 --create-missing --lat 13.75 --lon 100.50
+
+Images are matched to reports by ``image_path``. Images without a report are
+skipped unless ``--create-missing`` is given, in which case a new report is
+created for each through the normal submission code.
+"""
+import argparse
+import os
+import time
+
+import PIL.Image
+import PIL.ImageOps
+
+from images import annotated_path
+from inference import (BACKENDS, DEFAULT_BATCH_SIZE, DEFAULT_CONF, MODEL_BACKEND, MODEL_INT8,
+                       MODEL_PATH, MODEL_THREADS, load_yolo, predict_batch, severity_for,
+                       summarize_result)
+from report_store import open_store
+from submission import IMG_DIR, create_report
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png")
+
+
+def find_images(img_dir):
+    return sorted(
+        os.path.join(img_dir, name) for name in os.listdir(img_dir)
+        if name.lower().endswith(IMAGE_EXTS))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--dir", default=IMG_DIR, help="directory of images to score")
+    parser.add_argument("--rescore", action="store_true", help="overwrite existing AI results")
+    parser.add_argument("--create-missing", action="store_true", help="create reports for images without one")
+    parser.add_argument("--lat", type=float, default=13.7563, help="location for --create-missing reports")
+    parser.add_argument("--lon", type=float, default=100.5018, help="location for --create-missing reports")
+    parser.add_argument("--conf", type=float, default=DEFAULT_CONF)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--backend", default=MODEL_BACKEND, choices=BACKENDS)
+    parser.add_argument("--int8", action="store_true", default=MODEL_INT8)
+    parser.add_argument("--threads", type=int, default=MODEL_THREADS)
+    parser.add_argument("--store", default=os.environ.get("REPORT_STORE", "json"), choices=["json", "sqlite"])
+    parser.add_argument("--db", default="data_reports.json")
+    args = parser.parse_args(argv)
+
+    store = open_store(args.store, args.db)
+    by_path = {os.path.normpath(r['image_path']): r for r in store.load() if r.get('image_path')}
+
+    todo = []
+    for path in find_images(args.dir):
+        report = by_path.get(os.path.normpath(path))
+        if report is None:
+            if args.create_missing:
+                todo.append((path, None))
+        # details == {} means scored with nothing found; only unscored reports lack it
+        elif args.rescore or report.get('details') is None:
+            todo.append((path, report))
+    if not todo:
+        print("Nothing to do.")
+        return 0
+
+    model = load_yolo(args.model, backend=args.backend, int8=args.int8, threads=args.threads)
+    updated = created = 0
+    started = time.perf_counter()
+    for start in range(0, len(todo), args.batch_size):
+        chunk = todo[start:start + args.batch_size]
+        # upright like the stored copy (create_report rotates it the same way)
+        images = [PIL.ImageOps.exif_transpose(PIL.Image.open(path)) for path, _ in chunk]
+        results = predict_batch(model, images, conf=args.conf, batch_size=args.batch_size)
+        for (path, report), result in zip(chunk, results):
+            count, details = summarize_result(result)
+            if report is None:
+                with open(path, "rb") as f:
+                    data = f.read()
+                create_report(store, data, args.lat, args.lon, count, details,
+                              note=f"backfill: {os.path.basename(path)}", conf=args.conf)
+                # the report now owns a re-encoded copy; don't leave an orphan in IMG_DIR
+                if os.path.abspath(os.path.dirname(path)) == os.path.abspath(IMG_DIR):
+                    os.remove(path)
+                created += 1
+            else:
+                # ภาพผล AI เดิมมาจากโมเดล/ค่า conf เก่า ลบทิ้งให้สร้างใหม่ตอนเปิดดู
+                preview = annotated_path(report['image_path'])
+                if os.path.exists(preview):
+                    os.remove(preview)
+                store.put(dict(report, count=count, details=details, severity=severity_for(count), conf=args.conf))
+                updated += 1
+        done = start + len(chunk)
+        elapsed = time.perf_counter() - started
+        print(f"{done}/{len(todo)} images ({done / elapsed:.1f} images/sec)")
+
+    elapsed = time.perf_counter() - started
+    print(f"Scored {len(todo)} images in {elapsed:.1f}s ({len(todo) / elapsed:.1f} images/sec): "
+          f"{updated} reports updated, {created} created.")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
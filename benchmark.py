@@ -0,0 +1,347 @@
+"""Headless benchmarks for the report pipeline as the data grows.
+
+    python benchmark.py                                  # 1k, 10k, 100k reports, both stores
+    python benchmark.py --scales 1000 1000000 --stores sqlite --out bench.json
+    python benchmark.py --scales 1000 --images uploaded_images --backend onnx
+    python benchmark.py --scales 1000 --images drone/ --tile 640 --tile-overlap 0.2
+
+For every scale a synthetic dataset (reports spread around Bangkok) is written
+to a scratch directory, and the operations the app performs on each rerun are
+timed without Streamlit: loading the store, saving reports, filtering, KPIs,
+paging, map clustering, incident lookup and CSV export. Model inference is
+timed once (single image and batched) on sample images; with ``--tile`` the
+sliced-inference path is compared against the plain one. Cold-start import
+time of each app page is measured in fresh interpreters. Everything is written
+as JSON so runs can be compared between versions.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import PIL.Image
+
+from aggregates import ReportAggregates
+from export import export_reports
+from geo import SpatialIndex, find_incident
+from inference import (BACKENDS, DEFAULT_CONF, MODEL_BACKEND, MODEL_INT8, MODEL_PATH, MODEL_THREADS,
+                       SEVERITY_CRITICAL, SEVERITY_LOW, SEVERITY_MEDIUM, severity_for)
+from maps import ClusterIndex, marker_layer
+from report_store import JournalStore, SqliteStore
+
+DEFAULT_SCALES = (1000, 10000, 100000)
+STATUSES = ("รอรับเรื่อง", "กำลังดำเนินการ", "เสร็จสิ้น")
+STATUS_WEIGHTS = (5, 3, 2)
+CLASSES = ("plastic_bottle", "plastic_bag", "foam_box", "water_hyacinth", "can", "other")
+# จุดที่มีรายงานหนาแน่น (ริมเจ้าพระยา/คลองสายหลัก) ส่วนที่เหลือกระจายทั่วกรุงเทพฯ
+HOTSPOTS = ((13.7563, 100.5018), (13.7245, 100.5134), (13.8130, 100.5210),
+            (13.7390, 100.5600), (13.6900, 100.4500), (13.8450, 100.6100))
+BANGKOK_BBOX = (13.55, 100.35, 13.95, 100.85)
+WRITES = 200
+SPATIAL_QUERIES = 1000
+
+# modules each app page imports on a cold start (see app.py)
+APP_CORE_MODULES = ("streamlit", "PIL.Image", "metrics", "report_store", "inference", "inference_queue",
+                    "submission", "result_cache", "images", "aggregates", "geo")
+STARTUP_SETS = {
+    "app_core": APP_CORE_MODULES,
+    "citizen_page": APP_CORE_MODULES + ("folium", "streamlit_folium"),
+    "dashboard_page": APP_CORE_MODULES + ("folium", "streamlit_folium", "pandas", "export", "maps"),
+    "model_runtime": ("ultralytics",),
+}
+
+
+# ---------------------------------------------------------
+# Synthetic data
+# ---------------------------------------------------------
+def synthetic_reports(n, seed=0, start_id=1, now=None):
+    """Yield ``n`` report dicts shaped like the app's, reproducible for a given ``seed``."""
+    rng = random.Random(seed)
+    now = now or datetime.now()
+    for report_id in range(start_id, start_id + n):
+        if rng.random() < 0.8:
+            lat, lon = rng.choice(HOTSPOTS)
+            lat, lon = rng.gauss(lat, 0.02), rng.gauss(lon, 0.02)
+        else:
+            lat = rng.uniform(BANGKOK_BBOX[0], BANGKOK_BBOX[2])
+            lon = rng.uniform(BANGKOK_BBOX[1], BANGKOK_BBOX[3])
+        count = min(40, int(rng.expovariate(1 / 5)))
+        details = {}
+        for _ in range(count):
+            name = rng.choice(CLASSES)
+            details[name] = details.get(name, 0) + 1
+        yield {
+            "id": report_id,
+            "date": (now - timedelta(minutes=rng.randrange(180 * 24 * 60))).strftime("%Y-%m-%d %H:%M"),
+            "lat": round(lat, 6), "lon": round(lon, 6),
+            "count": count,
+            "details": details,
+            "severity": severity_for(count),
+            "note": rng.choice(["", "ถุงพลาสติก/ขวดน้ำ", "ผักตบชวา/วัชพืช", "กีดขวางทางระบายน้ำ"]),
+            "email": "",
+            "status": rng.choices(STATUSES, STATUS_WEIGHTS)[0],
+            "image_path": "uploaded_images/synthetic.jpg",
+        }
+
+
+def write_json_snapshot(path, reports):
+    """Stream reports into a snapshot file without holding the whole list."""
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("[\n")
+        for i, report in enumerate(reports):
+            if i:
+                f.write(",\n")
+            f.write(json.dumps(report, ensure_ascii=False))
+        f.write("\n]")
+
+
+def write_sqlite(path, reports, chunk=10000):
+    store = SqliteStore(path)
+    batch = []
+    for report in reports:
+        batch.append(report)
+        if len(batch) == chunk:
+            store.import_reports(batch)
+            batch = []
+    if batch:
+        store.import_reports(batch)
+
+
+def open_fresh(backend, workdir):
+    if backend == "sqlite":
+        return SqliteStore(os.path.join(workdir, "reports.db"))
+    return JournalStore(os.path.join(workdir, "reports.json"))
+
+
+# ---------------------------------------------------------
+# Timing
+# ---------------------------------------------------------
+def timed(fn, repeat=1):
+    """Run ``fn`` ``repeat`` times; returns ``(stats, last_result)``."""
+    times, result = [], None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - started)
+    return {"median_s": statistics.median(times), "min_s": min(times)}, result
+
+
+def max_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def bench_store(backend, n, workdir, repeat, seed):
+    results = {}
+    timing, _ = timed(lambda: (write_sqlite if backend == "sqlite" else write_json_snapshot)(
+        os.path.join(workdir, "reports.db" if backend == "sqlite" else "reports.json"),
+        synthetic_reports(n, seed)))
+    results["generate_and_write"] = timing
+
+    # load_data(): cold start of a new process
+    timing, reports = timed(lambda: open_fresh(backend, workdir).load(), repeat)
+    results["load"] = timing
+    store = open_fresh(backend, workdir)
+    store.load()
+
+    # save_data(): one new report + one status change per iteration
+    extra = list(synthetic_reports(WRITES, seed + 1, start_id=n + 1))
+
+    def writes():
+        for report in extra:
+            store.put(dict(report, id=store.next_id()))
+    timing, _ = timed(writes)
+    results["save_per_report_ms"] = timing["median_s"] * 1000 / WRITES
+
+    statuses, severities = list(STATUSES[:2]), [SEVERITY_CRITICAL, SEVERITY_MEDIUM, SEVERITY_LOW]
+    timing, filtered = timed(lambda: store.query(statuses=statuses, severities=severities), repeat)
+    results["filter"] = dict(timing, rows=len(filtered))
+    results["count_filtered"], _ = timed(lambda: store.count(statuses=statuses, severities=severities), repeat)
+    results["page_by_severity"], _ = timed(
+        lambda: store.page(statuses=statuses, order="severity", offset=100, limit=20), repeat)
+    results["page_by_distance"], _ = timed(
+        lambda: store.page(statuses=statuses, order="distance", limit=20, near=HOTSPOTS[0]), repeat)
+
+    # KPIs: scan (count_by) vs. incremental aggregates (rebuild once, then O(1) reads)
+    results["kpi_count_by"], _ = timed(lambda: store.count_by("status"), repeat)
+    aggregates = ReportAggregates()
+    results["kpi_aggregates_rebuild"], _ = timed(lambda: store.add_listener(aggregates))
+    results["kpi_aggregates_read"], _ = timed(lambda: (aggregates.status_counts(), aggregates.daily(30)), repeat)
+
+    # map: server-side clustering at city and street zoom, plus the folium layer
+    timing, index = timed(lambda: ClusterIndex(filtered))
+    results["map_index"] = timing
+    results["map_zoom11_all"], _ = timed(lambda: index.query(11), repeat)
+    street = (HOTSPOTS[0][0] - 0.01, HOTSPOTS[0][1] - 0.015, HOTSPOTS[0][0] + 0.01, HOTSPOTS[0][1] + 0.015)
+    timing, clusters = timed(lambda: index.query(15, street), repeat)
+    results["map_zoom15_viewport"] = dict(timing, clusters=len(clusters))
+    results["map_marker_layer"], _ = timed(lambda: marker_layer(clusters, 15), repeat)
+
+    # incident lookup for new submissions
+    spatial = SpatialIndex()
+    results["spatial_rebuild"], _ = timed(lambda: store.add_listener(spatial))
+    rng = random.Random(seed)
+    points = [(rng.gauss(lat, 0.02), rng.gauss(lon, 0.02)) for lat, lon in rng.choices(HOTSPOTS, k=SPATIAL_QUERIES)]
+    timing, _ = timed(lambda: [find_incident(spatial, lat, lon) for lat, lon in points])
+    results["incident_lookup_ms"] = timing["median_s"] * 1000 / SPATIAL_QUERIES
+
+    export_dir = os.path.join(workdir, "exports")
+    timing, path = timed(lambda: export_reports(store, "csv", statuses=statuses, export_dir=export_dir))
+    results["export_csv"] = dict(timing, bytes=os.path.getsize(path))
+
+    results["max_rss_mb"] = max_rss_mb()
+    return results
+
+
+def bench_inference(image_dir, backend, int8, threads, conf, batch_sizes, limit, tile=None, overlap=0.2):
+    from backfill import find_images
+    from inference import load_yolo, predict_batch, summarize_result
+
+    paths = find_images(image_dir)[:limit] if image_dir and os.path.isdir(image_dir) else []
+    if paths:
+        images = [PIL.Image.open(p).convert("RGB") for p in paths]
+    else:
+        # ไม่มีภาพตัวอย่าง: ใช้ภาพสุ่มขนาดเท่ารูปที่ ingest แล้ว (วัดเวลาได้ ผลตรวจจับไม่มีความหมาย)
+        rng = random.Random(0)
+        size = (3840, 2160) if tile else (1440, 1080)
+        images = [PIL.Image.frombytes("RGB", size, rng.randbytes(size[0] * size[1] * 3)) for _ in range(8)]
+
+    results = {"backend": backend, "int8": int8, "threads": threads, "images": len(images),
+               "sample_images": bool(paths)}
+    timing, model = timed(lambda: load_yolo(MODEL_PATH, backend=backend, int8=int8, threads=threads))
+    results["load_and_warm_up"] = timing
+    latencies = []
+    for image in images:
+        timing, _ = timed(lambda: model(image, conf=conf, verbose=False))
+        latencies.append(timing["median_s"] * 1000)
+    latencies.sort()
+    results["single_ms_p50"] = statistics.median(latencies)
+    results["single_ms_p95"] = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    results["batched"] = {}
+    for batch_size in batch_sizes:
+        timing, _ = timed(lambda: predict_batch(model, images, conf=conf, batch_size=batch_size, tile=None))
+        results["batched"][str(batch_size)] = dict(timing, images_per_s=len(images) / timing["median_s"])
+
+    if tile:
+        # sliced vs. plain: throughput and how many more objects the tiles find
+        results["tiling"] = {"tile": tile, "overlap": overlap}
+        batch_size = max(batch_sizes)
+        for mode, mode_tile in (("plain", None), ("tiled", tile)):
+            timing, predictions = timed(lambda: predict_batch(model, images, conf=conf, batch_size=batch_size,
+                                                              tile=mode_tile, overlap=overlap))
+            results["tiling"][mode] = dict(
+                timing, images_per_s=len(images) / timing["median_s"],
+                detections_mean=statistics.fmean(summarize_result(p)[0] for p in predictions))
+    return results
+
+
+def bench_startup(repeat):
+    """Import time of each page's modules in a fresh interpreter (what a new worker pays)."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    results = {}
+    for name, modules in STARTUP_SETS.items():
+        code = ("import time; t = time.perf_counter()\n"
+                + "".join(f"import {m}\n" for m in modules)
+                + "print(time.perf_counter() - t)")
+        times = []
+        for _ in range(repeat):
+            proc = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, cwd=here)
+            if proc.returncode != 0:
+                results[name] = {"error": proc.stderr.strip().splitlines()[-1] if proc.stderr else "failed"}
+                break
+            times.append(float(proc.stdout.strip().splitlines()[-1]))
+        else:
+            results[name] = {"median_s": statistics.median(times), "min_s": min(times)}
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--scales", type=int, nargs="+", default=list(DEFAULT_SCALES),
+                        help="numbers of reports to generate (1000 - 1000000)")
+    parser.add_argument("--stores", nargs="+", default=["json", "sqlite"], choices=["json", "sqlite"])
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs for the cheaper operations")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--images", help="sample images for the inference benchmark")
+    parser.add_argument("--no-inference", action="store_true", help="skip the model benchmark")
+    parser.add_argument("--no-startup", action="store_true", help="skip the cold-start import timing")
+    parser.add_argument("--backend", default=MODEL_BACKEND, choices=BACKENDS)
+    parser.add_argument("--int8", action="store_true", default=MODEL_INT8)
+    parser.add_argument("--threads", type=int, default=MODEL_THREADS)
+    parser.add_argument("--conf", type=float, default=DEFAULT_CONF)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--limit", type=int, default=16, help="max sample images")
+    parser.add_argument("--tile", type=int, help="also benchmark sliced inference with this tile size")
+    parser.add_argument("--tile-overlap", type=float, default=0.2)
+    parser.add_argument("--out", default="benchmark_results.json")
+    args = parser.parse_args(argv)
+
+    report = {
+        "meta": {"date": datetime.now().isoformat(timespec="seconds"), "git": git_revision(),
+                 "python": platform.python_version(), "platform": platform.platform(),
+                 "cpus": os.cpu_count(), "seed": args.seed},
+        "stores": {},
+    }
+    for n in args.scales:
+        for backend in args.stores:
+            with tempfile.TemporaryDirectory(prefix="bench_") as workdir:
+                started = time.perf_counter()
+                results = bench_store(backend, n, workdir, args.repeat, args.seed)
+            report["stores"].setdefault(str(n), {})[backend] = results
+            print(f"{backend:>6} {n:>8}: load={results['load']['median_s']:.3f}s "
+                  f"save={results['save_per_report_ms']:.2f}ms filter={results['filter']['median_s']:.3f}s "
+                  f"export={results['export_csv']['median_s']:.3f}s ({time.perf_counter() - started:.1f}s total)")
+
+    if not args.no_startup:
+        report["startup"] = bench_startup(args.repeat)
+        print("startup: " + " ".join(
+            f"{name}={r['median_s']:.2f}s" if "median_s" in r else f"{name}=error"
+            for name, r in report["startup"].items()))
+
+    if not args.no_inference:
+        try:
+            report["inference"] = bench_inference(args.images, args.backend, args.int8, args.threads,
+                                                  args.conf, args.batch_sizes, args.limit, args.tile,
+                                                  args.tile_overlap)
+            print(f"inference: p50={report['inference']['single_ms_p50']:.1f}ms " + " ".join(
+                f"b{b}={r['images_per_s']:.1f}img/s" for b, r in report["inference"]["batched"].items()))
+            if "tiling" in report["inference"]:
+                tiling = report["inference"]["tiling"]
+                print(f"   tiling: plain={tiling['plain']['images_per_s']:.2f}img/s "
+                      f"({tiling['plain']['detections_mean']:.1f} det) "
+                      f"tiled={tiling['tiled']['images_per_s']:.2f}img/s ({tiling['tiled']['detections_mean']:.1f} det)")
+        except Exception as e:
+            report["inference"] = {"error": str(e)}
+            print(f"inference: skipped ({e})")
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=4, ensure_ascii=False)
+    print(f"wrote {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
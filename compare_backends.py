@@ -0,0 +1,121 @@
+"""Compare inference runtimes on a sample set: per-image latency and detection drift.
+
+    python compare_backends.py --images uploaded_images
+    python compare_backends.py --images samples/ --backends torch onnx openvino --int8 --threads 4
+
+The first backend listed is the reference. For every other backend the script
+reports how often the per-image object count matches, the mean absolute
+difference in counts, and box-level precision/recall (same class, IoU >= 0.5)
+against the reference detections.
+"""
+import argparse
+import json
+import statistics
+import time
+
+import PIL.Image
+
+from backfill import find_images
+from inference import BACKENDS, DEFAULT_CONF, MODEL_PATH, load_yolo, summarize_result
+
+
+def _iou(a, b):
+    ix = max(0.0, min(a[2], b[2]) - max(a[0], b[0]))
+    iy = max(0.0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = ix * iy
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def match_boxes(reference, candidate, iou_threshold=0.5):
+    """Greedy same-class matching of ``(cls, xyxy, score)`` detections.
+
+    Returns the number of matched pairs.
+    """
+    matched = 0
+    unused = list(candidate)
+    for cls, box, _ in sorted(reference, key=lambda d: d[2], reverse=True):
+        best, best_iou = None, iou_threshold
+        for i, (c_cls, c_box, _) in enumerate(unused):
+            if c_cls == cls and _iou(box, c_box) >= best_iou:
+                best, best_iou = i, _iou(box, c_box)
+        if best is not None:
+            unused.pop(best)
+            matched += 1
+    return matched
+
+
+def run_backend(backend, images, conf, int8, threads, repeat):
+    model = load_yolo(MODEL_PATH, backend=backend, int8=int8, threads=threads, warmup=True)
+    latencies, detections = [], []
+    for image in images:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = model(image, conf=conf, verbose=False)[0]
+            latencies.append((time.perf_counter() - started) * 1000)
+        count, details = summarize_result(result)
+        boxes = [(int(c), box, s) for c, box, s in zip(
+            result.boxes.cls.tolist(), result.boxes.xyxy.tolist(), result.boxes.conf.tolist())]
+        detections.append({"count": count, "details": details, "boxes": boxes})
+    latencies.sort()
+    return {
+        "latency_ms_p50": statistics.median(latencies),
+        "latency_ms_p95": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+        "latency_ms_mean": statistics.fmean(latencies),
+    }, detections
+
+
+def agreement(reference, candidate):
+    same_count = sum(r["count"] == c["count"] for r, c in zip(reference, candidate))
+    count_diff = [abs(r["count"] - c["count"]) for r, c in zip(reference, candidate)]
+    matched = sum(match_boxes(r["boxes"], c["boxes"]) for r, c in zip(reference, candidate))
+    ref_boxes = sum(len(r["boxes"]) for r in reference)
+    cand_boxes = sum(len(c["boxes"]) for c in candidate)
+    return {
+        "count_match_rate": same_count / len(reference),
+        "count_abs_diff_mean": statistics.fmean(count_diff),
+        "box_recall": matched / ref_boxes if ref_boxes else 1.0,
+        "box_precision": matched / cand_boxes if cand_boxes else 1.0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--images", default="uploaded_images", help="directory of sample images")
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument("--int8", action="store_true", help="quantize the exported backends")
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--conf", type=float, default=DEFAULT_CONF)
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per image")
+    parser.add_argument("--limit", type=int, default=50, help="max images to use")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args(argv)
+
+    paths = find_images(args.images)[:args.limit]
+    if not paths:
+        parser.error(f"no images found in {args.images}")
+    images = [PIL.Image.open(p).convert("RGB") for p in paths]
+
+    report = {"images": len(images), "threads": args.threads, "int8": args.int8, "backends": {}}
+    reference = None
+    for backend in args.backends:
+        timing, detections = run_backend(
+            backend, images, args.conf, args.int8 and backend != "torch", args.threads, args.repeat)
+        entry = dict(timing)
+        if reference is None:
+            reference = detections
+            entry["reference"] = True
+        else:
+            entry.update(agreement(reference, detections))
+        report["backends"][backend] = entry
+        print(f"{backend:>9}: " + ", ".join(
+            f"{k}={v:.3f}" if isinstance(v, float) else f"{k}={v}" for k, v in entry.items()))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,98 @@
+"""On-demand report export (CSV or Parquet), streamed from the store in chunks.
+
+Reports are read ``CHUNK_SIZE`` at a time with ``store.iter_query()`` and
+written straight to a file under ``EXPORT_DIR``, so memory use depends on the
+chunk size rather than on how many reports are held. ``details`` (the AI count
+per class) is flattened into one ``count_<class>`` column per class; a first
+pass over the filtered reports collects the class names so every chunk shares
+the same columns.
+"""
+import csv
+import os
+import tempfile
+import time
+
+EXPORT_DIR = "exports"
+EXPORT_FORMATS = {"csv": "text/csv", "parquet": "application/vnd.apache.parquet"}
+CHUNK_SIZE = 1000
+# ไฟล์ export ที่เก่ากว่านี้ (วินาที) ถูกลบตอน export ครั้งถัดไป
+EXPORT_TTL = 3600
+
+EXPORT_FIELDS = ("id", "date", "lat", "lon", "count", "severity", "note", "email",
+                 "status", "incident_id", "image_path")
+
+
+def detail_classes(store, statuses=None, severities=None, chunk_size=CHUNK_SIZE):
+    classes = set()
+    for chunk in store.iter_query(statuses, severities, chunk_size):
+        for report in chunk:
+            classes.update((report.get('details') or {}).keys())
+    return sorted(classes)
+
+
+def flatten(report, classes):
+    """One export row: the fixed fields plus a count column per class."""
+    row = {field: report.get(field) for field in EXPORT_FIELDS}
+    if row['incident_id'] is None:
+        row['incident_id'] = report['id']
+    details = report.get('details') or {}
+    for name in classes:
+        row[f"count_{name}"] = int(details.get(name, 0))
+    return row
+
+
+def _write_csv(path, chunks, columns, classes):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        for chunk in chunks:
+            writer.writerows(flatten(r, classes) for r in chunk)
+
+
+def _write_parquet(path, chunks, columns, classes):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    types = {"id": pa.int64(), "lat": pa.float64(), "lon": pa.float64(),
+             "count": pa.int64(), "incident_id": pa.int64()}
+    schema = pa.schema([(c, types.get(c, pa.int64() if c.startswith("count_") else pa.string()))
+                        for c in columns])
+    with pq.ParquetWriter(path, schema) as writer:
+        for chunk in chunks:
+            rows = [flatten(r, classes) for r in chunk]
+            # one row group per chunk
+            writer.write_table(pa.table({c: [row[c] for row in rows] for c in columns}, schema=schema))
+
+
+def _remove_stale(export_dir):
+    cutoff = time.time() - EXPORT_TTL
+    for name in os.listdir(export_dir):
+        path = os.path.join(export_dir, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def export_reports(store, fmt="csv", statuses=None, severities=None, export_dir=EXPORT_DIR,
+                   chunk_size=CHUNK_SIZE):
+    """Write the reports matching the filters to a new file; returns its path."""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    os.makedirs(export_dir, exist_ok=True)
+    _remove_stale(export_dir)
+    classes = detail_classes(store, statuses, severities, chunk_size)
+    columns = list(EXPORT_FIELDS) + [f"count_{name}" for name in classes]
+    fd, path = tempfile.mkstemp(prefix="waste_report_", suffix=f".{fmt}", dir=export_dir)
+    os.close(fd)
+    chunks = store.iter_query(statuses, severities, chunk_size)
+    try:
+        if fmt == "parquet":
+            _write_parquet(path, chunks, columns, classes)
+        else:
+            _write_csv(path, chunks, columns, classes)
+    except Exception:
+        os.remove(path)
+        raise
+    return path
@@ -0,0 +1,104 @@
+"""Spatial index over report locations, used to merge nearby reports into incidents.
+
+``SpatialIndex`` buckets reports into a fixed grid of roughly ``cell_m`` metre
+cells. A radius query only visits the cells that overlap the search circle, so
+"reports within N metres in the last T hours" costs time proportional to the
+reports around that point, not to the whole backlog. The index is a store
+listener: the store calls ``rebuild()`` when it (re)loads and ``apply()`` for
+every insert, update and delete.
+"""
+import math
+import threading
+from datetime import datetime, timedelta
+
+EARTH_RADIUS_M = 6371000.0
+METRES_PER_DEG_LAT = 111320.0
+
+# รายงานที่อยู่ห่างกันไม่เกินนี้ ภายในช่วงเวลานี้ ถือเป็นเหตุการณ์เดียวกัน
+INCIDENT_RADIUS_M = 100
+INCIDENT_WINDOW_HOURS = 48
+STATUS_DONE = "เสร็จสิ้น"
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp, dl = p2 - p1, math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+class SpatialIndex:
+    def __init__(self, cell_m=200):
+        self.cell_deg = cell_m / METRES_PER_DEG_LAT
+        self._cells = {}   # (y, x) -> {report_id: (lat, lon, date, status, incident_id)}
+        self._where = {}   # report_id -> (y, x)
+        self._lock = threading.Lock()
+
+    def _key(self, lat, lon):
+        return math.floor(lat / self.cell_deg), math.floor(lon / self.cell_deg)
+
+    def _insert(self, report):
+        if report.get('lat') is None or report.get('lon') is None:
+            return
+        key = self._key(report['lat'], report['lon'])
+        self._cells.setdefault(key, {})[report['id']] = (
+            report['lat'], report['lon'], report.get('date', ''), report.get('status'),
+            report.get('incident_id', report['id']))
+        self._where[report['id']] = key
+
+    def _remove(self, report_id):
+        key = self._where.pop(report_id, None)
+        if key is not None:
+            cell = self._cells[key]
+            cell.pop(report_id, None)
+            if not cell:
+                del self._cells[key]
+
+    # --- store listener ---
+    def rebuild(self, reports):
+        with self._lock:
+            self._cells, self._where = {}, {}
+            for report in reports:
+                self._insert(report)
+
+    def apply(self, old, new):
+        with self._lock:
+            if old is not None:
+                self._remove(old['id'])
+            if new is not None:
+                self._insert(new)
+
+    def __len__(self):
+        return len(self._where)
+
+    def nearby(self, lat, lon, radius_m, since=None, include_done=True):
+        """``[(distance_m, report_id, incident_id)]`` within ``radius_m``, nearest first.
+
+        ``since`` (datetime) drops reports dated earlier than that.
+        """
+        since_str = since.strftime("%Y-%m-%d %H:%M") if since else None
+        dy = math.ceil(radius_m / METRES_PER_DEG_LAT / self.cell_deg)
+        lon_scale = max(math.cos(math.radians(lat)), 1e-6)
+        dx = math.ceil(radius_m / (METRES_PER_DEG_LAT * lon_scale) / self.cell_deg)
+        y0, x0 = self._key(lat, lon)
+        found = []
+        with self._lock:
+            for y in range(y0 - dy, y0 + dy + 1):
+                for x in range(x0 - dx, x0 + dx + 1):
+                    for report_id, (r_lat, r_lon, date, status, incident_id) in self._cells.get((y, x), {}).items():
+                        if since_str and date < since_str:
+                            continue
+                        if not include_done and status == STATUS_DONE:
+                            continue
+                        distance = haversine_m(lat, lon, r_lat, r_lon)
+                        if distance <= radius_m:
+                            found.append((distance, report_id, incident_id))
+        found.sort()
+        return found
+
+
+def find_incident(index, lat, lon, radius_m=INCIDENT_RADIUS_M, window_hours=INCIDENT_WINDOW_HOURS):
+    """Incident ID an open report near ``(lat, lon)`` belongs to, or ``None``."""
+    since = datetime.now() - timedelta(hours=window_hours)
+    matches = index.nearby(lat, lon, radius_m, since=since, include_done=False)
+    return matches[0][2] if matches else None
@@ -0,0 +1,81 @@
+"""Image ingest: normalise uploads once, serve small variants to the dashboard.
+
+Every stored photo gets three variants that share a file name::
+
+    uploaded_images/report_7_20260301_101500.jpg             # original, capped at MAX_SIDE
+    uploaded_images/thumbs/report_7_20260301_101500.jpg      # THUMB_SIDE, for the task list
+    uploaded_images/annotated/report_7_20260301_101500.jpg   # AI boxes, filled lazily
+
+Reports created before the ingest stage existed get their thumbnail on first
+view.
+"""
+import io
+import os
+from datetime import datetime
+
+import PIL.Image
+import PIL.ImageOps
+
+MAX_SIDE = 1920
+THUMB_SIDE = 320
+JPEG_QUALITY = 85
+
+
+def _variant_path(image_path, variant):
+    folder, name = os.path.split(image_path)
+    return os.path.join(folder, variant, os.path.splitext(name)[0] + ".jpg")
+
+
+def thumbnail_path(image_path):
+    return _variant_path(image_path, "thumbs")
+
+
+def annotated_path(image_path):
+    return _variant_path(image_path, "annotated")
+
+
+def _save_jpeg(image, path, max_side):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    image = image.copy()
+    image.thumbnail((max_side, max_side), PIL.Image.LANCZOS)
+    image.save(path, "JPEG", quality=JPEG_QUALITY, optimize=True)
+
+
+def ingest_image(data, report_id, img_dir):
+    """Store an uploaded photo for ``report_id``; returns its ``image_path``.
+
+    The photo is rotated upright from its EXIF orientation, capped at
+    ``MAX_SIDE`` pixels and re-encoded as JPEG (phone photos shrink from several
+    MB to a few hundred KB); a thumbnail is written alongside (its path follows
+    from ``thumbnail_path(image_path)``, so reports don't store it).
+    """
+    image = PIL.ImageOps.exif_transpose(PIL.Image.open(io.BytesIO(bytes(data)))).convert("RGB")
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    image_path = f"{img_dir}/report_{report_id}_{timestamp}.jpg"
+    _save_jpeg(image, image_path, MAX_SIDE)
+    _save_jpeg(image, thumbnail_path(image_path), THUMB_SIDE)
+    return image_path
+
+
+def ensure_thumbnail(image_path):
+    """Thumbnail for ``image_path``, creating it on first use; ``None`` if the photo is gone."""
+    thumb = thumbnail_path(image_path)
+    if not os.path.exists(thumb):
+        if not os.path.exists(image_path):
+            return None
+        with PIL.Image.open(image_path) as image:
+            _save_jpeg(PIL.ImageOps.exif_transpose(image).convert("RGB"), thumb, THUMB_SIDE)
+    return thumb
+
+
+def save_annotated(image_path, plotted):
+    """Store the AI-annotated preview (RGB PIL image) for ``image_path``."""
+    path = annotated_path(image_path)
+    _save_jpeg(plotted.convert("RGB"), path, MAX_SIDE)
+    return path
+
+
+def remove_image_files(image_path):
+    for path in (image_path, thumbnail_path(image_path), annotated_path(image_path)):
+        if os.path.exists(path):
+            os.remove(path)
@@ -0,0 +1,182 @@
+"""YOLO model loading and inference helpers shared by the app and CLI tools.
+
+The runtime is picked with ``MODEL_BACKEND``:
+
+* ``torch`` (default) - the PyTorch weights through ultralytics.
+* ``onnx`` - exported once to ``<model>.onnx`` and run on ONNX Runtime.
+* ``openvino`` - exported once to ``<model>_openvino_model/`` and run on OpenVINO.
+
+``MODEL_INT8=1`` quantizes the exported model (dynamic INT8 for ONNX, NNCF
+post-training INT8 for OpenVINO) and ``MODEL_THREADS`` pins the CPU thread
+count. Use ``compare_backends.py`` to measure latency and detection drift
+before switching.
+
+``ultralytics`` (torch and friends, several seconds) is imported on first
+model load, not when this module is imported, so pages and tools that never
+run the model don't pay for it.
+
+``MODEL_TILE=640`` turns on sliced inference for frames larger than one tile
+(see ``tiling.py``; ``MODEL_TILE_OVERLAP`` sets the overlap, default 0.2).
+"""
+import glob
+import os
+from collections import Counter
+
+import PIL.Image
+
+import metrics
+from tiling import needs_tiling, predict_tiled
+
+MODEL_PATH = "best.pt"
+FALLBACK_MODEL = "yolov8n.pt"
+DEFAULT_CONF = 0.25
+DEFAULT_BATCH_SIZE = 8
+IMGSZ = 640
+
+MODEL_BACKEND = os.environ.get("MODEL_BACKEND", "torch")
+MODEL_INT8 = os.environ.get("MODEL_INT8", "0") == "1"
+MODEL_THREADS = int(os.environ.get("MODEL_THREADS", "0")) or None
+BACKENDS = ("torch", "onnx", "openvino")
+TILE_SIZE = int(os.environ.get("MODEL_TILE", "0")) or None
+TILE_OVERLAP = float(os.environ.get("MODEL_TILE_OVERLAP", "0.2"))
+
+SEVERITY_CRITICAL = "🔴 วิกฤต"
+SEVERITY_MEDIUM = "🟠 ปานกลาง"
+SEVERITY_LOW = "🟢 เล็กน้อย"
+
+# result.speed (ms per image) -> metrics phase
+_SPEED_PHASES = (("preprocess", "inference_preprocess"), ("inference", "inference_forward"),
+                 ("postprocess", "inference_postprocess"))
+
+
+def export_model(model_path, backend, int8=False):
+    """Export ``model_path`` for ``backend`` (once) and return the exported path."""
+    from ultralytics import YOLO
+
+    stem = os.path.splitext(model_path)[0]
+    if backend == "onnx":
+        onnx_path = f"{stem}.onnx"
+        if not os.path.exists(onnx_path):
+            onnx_path = YOLO(model_path).export(format="onnx", imgsz=IMGSZ, dynamic=True)
+        if not int8:
+            return onnx_path
+        int8_path = f"{stem}_int8.onnx"
+        if not os.path.exists(int8_path):
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            quantize_dynamic(onnx_path, int8_path, weight_type=QuantType.QUInt8)
+        return int8_path
+    if backend == "openvino":
+        ov_dir = f"{stem}_int8_openvino_model" if int8 else f"{stem}_openvino_model"
+        if not os.path.exists(ov_dir):
+            ov_dir = YOLO(model_path).export(format="openvino", imgsz=IMGSZ, int8=int8, dynamic=True)
+        return ov_dir
+    raise ValueError(f"Unknown model backend: {backend}")
+
+
+def _pin_threads(model, backend, weights, threads):
+    """Limit the runtime to ``threads`` CPU threads (call after the first predict).
+
+    ultralytics doesn't expose thread settings for exported models, so the
+    ONNX session / OpenVINO compiled model it created is swapped for one
+    built with the thread count set.
+    """
+    if backend == "torch":
+        import torch
+        torch.set_num_threads(threads)
+        return
+    runtime = getattr(model.predictor, "model", None)
+    if backend == "onnx" and hasattr(runtime, "session"):
+        import onnxruntime
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        runtime.session = onnxruntime.InferenceSession(weights, options, providers=["CPUExecutionProvider"])
+    elif backend == "openvino" and hasattr(runtime, "ov_compiled_model"):
+        import openvino
+        core = openvino.Core()
+        runtime.ov_compiled_model = core.compile_model(
+            core.read_model(glob.glob(os.path.join(weights, "*.xml"))[0]), "CPU",
+            {"INFERENCE_NUM_THREADS": threads, "PERFORMANCE_HINT": "LATENCY"})
+
+
+def warm_up(model):
+    """One throwaway inference so the first citizen doesn't pay for lazy init."""
+    model(PIL.Image.new("RGB", (IMGSZ, IMGSZ)), verbose=False)
+
+
+def load_yolo(model_path=MODEL_PATH, backend=MODEL_BACKEND, int8=MODEL_INT8, threads=MODEL_THREADS, warmup=True):
+    from ultralytics import YOLO
+
+    if not os.path.exists(model_path):
+        model_path = FALLBACK_MODEL
+    if backend == "torch":
+        weights = model_path
+        model = YOLO(weights)
+    else:
+        weights = export_model(model_path, backend, int8)
+        model = YOLO(weights, task="detect")
+    if warmup or threads:
+        warm_up(model)
+    if threads:
+        _pin_threads(model, backend, weights, threads)
+    return model
+
+
+def model_tag(model_path=MODEL_PATH, backend=MODEL_BACKEND, int8=MODEL_INT8, tile=TILE_SIZE,
+              overlap=TILE_OVERLAP):
+    """Identifies the weights + runtime (+ tiling), so cached results are dropped when any changes."""
+    model_stamp = os.path.getmtime(model_path) if os.path.exists(model_path) else 0
+    tag = f"{model_path}@{model_stamp}:{backend}:{int(int8)}"
+    return f"{tag}:tile{tile}x{overlap}" if tile else tag
+
+
+def severity_for(count):
+    return SEVERITY_CRITICAL if count > 10 else (SEVERITY_MEDIUM if count > 5 else SEVERITY_LOW)
+
+
+def summarize_result(result):
+    """Return ``(total_count, counts_dict)`` for one YOLO result."""
+    cls_indices = result.boxes.cls.tolist()
+    names_dict = result.names
+    counts_dict = Counter([names_dict[int(x)] for x in cls_indices])
+    return len(cls_indices), dict(counts_dict)
+
+
+def _record_speed(result):
+    speed = getattr(result, "speed", None) or {}
+    for key, phase in _SPEED_PHASES:
+        if speed.get(key) is not None:
+            metrics.observe(phase, speed[key] / 1000)
+
+
+def predict_batch(model, images, conf=DEFAULT_CONF, batch_size=DEFAULT_BATCH_SIZE, on_progress=None,
+                  tile=TILE_SIZE, overlap=TILE_OVERLAP):
+    """Run inference over ``images`` ``batch_size`` at a time.
+
+    Returns one YOLO result per image, in order. ``on_progress(done, total)`` is
+    called after every batch. With ``tile``, images larger than one tile go
+    through ``tiling.predict_tiled`` (their tiles are batched instead). Per-image
+    preprocess/forward/postprocess times (``result.speed``) are recorded in
+    ``metrics``.
+    """
+    results = [None] * len(images)
+    done = 0
+    plain = []
+    for i, image in enumerate(images):
+        if tile and needs_tiling(image, tile):
+            results[i] = predict_tiled(model, image, conf, tile, overlap, batch_size)
+            _record_speed(results[i])
+            done += 1
+            if on_progress:
+                on_progress(done, len(images))
+        else:
+            plain.append(i)
+    for start in range(0, len(plain), batch_size):
+        batch = plain[start:start + batch_size]
+        for i, result in zip(batch, model([images[i] for i in batch], conf=conf, verbose=False)):
+            _record_speed(result)
+            results[i] = result
+        done += len(batch)
+        if on_progress:
+            on_progress(done, len(images))
+    return results
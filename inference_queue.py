@@ -0,0 +1,228 @@
+"""Bounded inference worker pool.
+
+Worker threads each own one model instance (YOLO models are not safe to call
+from several threads at once). The UI submits images, gets an ``InferenceJob``
+handle back immediately and polls it, so a session's rerun never blocks on a
+forward pass and concurrent citizens are served in FIFO order.
+
+Workers load (and warm up) their model in the background as soon as the queue
+is created; ``ready`` tells whether every worker has finished loading. Jobs
+submitted before that simply wait in the queue.
+
+With a ``ResultCache``, images whose content digest was already analysed at the
+same confidence skip the model; a job made only of cached images finishes at
+submit time without entering the queue.
+"""
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+import PIL.Image
+
+import metrics
+from inference import DEFAULT_BATCH_SIZE, DEFAULT_CONF, predict_batch, summarize_result
+
+# จำนวนงานที่เสร็จแล้วที่เก็บผลไว้ให้ UI มาอ่าน
+FINISHED_JOBS_KEPT = 256
+
+
+class QueueFull(Exception):
+    """Raised by ``InferenceQueue.submit`` when too many jobs are waiting."""
+
+
+class InferenceJob:
+    def __init__(self, job_id, seq, images, conf, batch_size, plot, digests=None):
+        self.id = job_id
+        self.seq = seq
+        self.images = images
+        self.digests = digests
+        self.conf = conf
+        self.batch_size = batch_size
+        self.plot = plot
+        self.status = "queued"  # queued -> running -> done | error
+        self.progress = 0.0
+        self.results = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._done = threading.Event()
+        self._callbacks = []
+        self._callbacks_lock = threading.Lock()
+
+    @property
+    def finished(self):
+        return self.status in ("done", "error")
+
+    def wait(self, timeout=None):
+        """Block until the job is done or failed; ``False`` on timeout."""
+        return self._done.wait(timeout)
+
+    def add_done_callback(self, fn):
+        """Call ``fn(job)`` once the job finishes (on the worker thread), or now if it already has."""
+        with self._callbacks_lock:
+            if not self._done.is_set():
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def _finish(self):
+        with self._callbacks_lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            fn(self)
+
+
+class InferenceQueue:
+    def __init__(self, model_factory, workers=1, max_pending=16, cache=None):
+        self.model_factory = model_factory
+        self.cache = cache
+        self.max_pending = max_pending
+        self.load_error = None
+        self.created_at = time.time()
+        self.ready_at = None
+        self._ready = threading.Event()
+        self._loaded = 0
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._seq = 0  # seq ของงานล่าสุดที่รับเข้าคิว (งานที่ถูกปฏิเสธไม่นับ)
+        self._taken = 0
+        self._busy = 0
+        self._workers = [
+            threading.Thread(target=self._run, name=f"inference-worker-{i}", daemon=True)
+            for i in range(workers)]
+        for worker in self._workers:
+            worker.start()
+
+    @property
+    def ready(self):
+        """Every worker has loaded its model (or failed to; see ``load_error``)."""
+        return self._ready.is_set()
+
+    def wait_ready(self, timeout=None):
+        return self._ready.wait(timeout)
+
+    @property
+    def load_seconds(self):
+        """Queue creation to all models loaded and warmed up; ``None`` while loading."""
+        return None if self.ready_at is None else self.ready_at - self.created_at
+
+    @property
+    def depth(self):
+        """Jobs waiting for a worker (not counting the ones being processed)."""
+        return self._queue.qsize()
+
+    @property
+    def busy(self):
+        return self._busy
+
+    def position(self, job):
+        """How many queued jobs are ahead of ``job``."""
+        if job.status != "queued":
+            return 0
+        return max(0, job.seq - 1 - self._taken)
+
+    def submit(self, images, conf=DEFAULT_CONF, batch_size=DEFAULT_BATCH_SIZE, plot=False, digests=None):
+        """Queue ``images`` for inference; ``digests`` (content hashes) enable the result cache."""
+        cached = self._cached_results(digests, conf, plot) if digests else None
+        with self._lock:
+            seq = self._seq + 1
+            job = InferenceJob(f"job-{seq}", seq, list(images), conf, batch_size, plot, digests)
+            if cached is not None and all(cached):
+                self._taken += 1
+                job.results, job.images = cached, None
+                job.progress, job.status = 1.0, "done"
+                job.started_at = job.finished_at = time.time()
+                job._finish()
+            else:
+                try:
+                    self._queue.put_nowait(job)
+                except queue.Full:
+                    raise QueueFull(f"{self.max_pending} inference jobs already waiting") from None
+            self._seq = seq
+            self._jobs[job.id] = job
+            self._forget_old_jobs()
+        return job
+
+    def _cached_results(self, digests, conf, plot):
+        if self.cache is None:
+            return [None] * len(digests)
+        results = []
+        for digest in digests:
+            hit = self.cache.get(digest, conf)
+            if hit is not None and plot and hit["plotted"] is None:
+                hit = None
+            results.append(hit)
+        return results
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def _forget_old_jobs(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - FINISHED_JOBS_KEPT)]:
+            del self._jobs[job_id]
+
+    def _run(self):
+        started = time.perf_counter()
+        try:
+            model = self.model_factory()
+        except Exception as e:
+            self.load_error = e
+            model = None
+        metrics.observe("model_load", time.perf_counter() - started)
+        with self._lock:
+            self._loaded += 1
+            if self._loaded == len(self._workers):
+                self.ready_at = time.time()
+                self._ready.set()
+        while True:
+            job = self._queue.get()
+            with self._lock:
+                self._taken += 1
+                self._busy += 1
+            job.status = "running"
+            job.started_at = time.time()
+            metrics.observe("inference_queue_wait", job.started_at - job.submitted_at)
+            try:
+                if model is None:
+                    raise RuntimeError(f"Error loading model: {self.load_error}")
+                job.progress = 0.05
+
+                def on_progress(done, total):
+                    # 0.05-0.9: forward passes, the rest is counting/plotting
+                    job.progress = 0.05 + 0.85 * done / total
+
+                job.results = (self._cached_results(job.digests, job.conf, job.plot)
+                               if job.digests else [None] * len(job.images))
+                misses = [i for i, hit in enumerate(job.results) if hit is None]
+                results = predict_batch(model, [job.images[i] for i in misses], conf=job.conf,
+                                        batch_size=job.batch_size, on_progress=on_progress)
+                for i, result in zip(misses, results):
+                    summarize_started = time.perf_counter()
+                    total_count, counts_dict = summarize_result(result)
+                    boxes = {"xyxy": result.boxes.xyxy.tolist(), "cls": result.boxes.cls.tolist(),
+                             "conf": result.boxes.conf.tolist()}
+                    # result.plot() gives BGR; keep RGB everywhere else
+                    plotted = PIL.Image.fromarray(result.plot()[..., ::-1]) if job.plot else None
+                    job.results[i] = {"count": total_count, "details": counts_dict,
+                                      "boxes": boxes, "plotted": plotted}
+                    metrics.observe("inference_summarize", time.perf_counter() - summarize_started)
+                    if self.cache is not None and job.digests:
+                        self.cache.put(job.digests[i], job.conf, total_count, counts_dict, boxes, plotted)
+                job.progress = 1.0
+                job.status = "done"
+            except Exception as e:
+                job.error = e
+                job.status = "error"
+            finally:
+                job.images = None
+                job.finished_at = time.time()
+                metrics.observe("inference_job", job.finished_at - job.started_at)
+                with self._lock:
+                    self._busy -= 1
+                job._finish()
+                self._queue.task_done()
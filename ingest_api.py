@@ -0,0 +1,357 @@
+"""HTTP ingest service for automated sources (patrol boats, fixed cameras, drones).
+
+    python ingest_api.py serve --port 8600        # runs next to `streamlit run app.py`
+    python ingest_api.py send http://localhost:8600 --lat 13.75 --lon 100.50 a.jpg b.jpg
+
+    curl -F lat=13.75 -F lon=100.50 -F note="boat 3" -F image=@a.jpg -F image=@b.jpg \\
+         http://localhost:8600/v1/reports
+
+Endpoints:
+
+* ``POST /v1/reports`` - multipart form with ``lat``, ``lon``, optional
+  ``note``/``email`` and one or more image files. Every image becomes one
+  report, exactly as if it had been sent from the citizen page (same model,
+  severity, duplicate detection, incident merging and store), and the response
+  lists the new report IDs - the IDs the app's Tracking box looks up.
+* ``GET /v1/reports/<id>`` - the status of one report.
+* ``GET /healthz`` - model and queue state.
+* ``GET /readyz`` - 200 once the model is loaded and warmed up, 503 before.
+* ``GET /metrics`` - Prometheus metrics of this process.
+
+Images from concurrent requests are coalesced: requests arriving within
+``COALESCE_WAIT`` seconds of each other are sent to the model as one batch (up
+to ``COALESCE_MAX_IMAGES``), which is far cheaper per image than one forward
+pass per upload.
+
+The service has no authentication of its own and listens on 127.0.0.1 by
+default. To accept uploads from field devices, put it behind a reverse proxy
+that authenticates them (and bind ``--host`` only to the proxy's network).
+"""
+import argparse
+import email.parser
+import email.policy
+import io
+import json
+import os
+import queue
+import threading
+import time
+import urllib.request
+import uuid
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import PIL.Image
+import PIL.ImageOps
+
+import metrics
+from geo import SpatialIndex
+from inference import DEFAULT_BATCH_SIZE, DEFAULT_CONF, load_yolo, model_tag
+from inference_queue import InferenceQueue, QueueFull
+from report_store import open_store
+from result_cache import ResultCache, image_digest
+from submission import IMG_DIR, submit_photo
+
+DEFAULT_PORT = 8600
+MAX_UPLOAD_BYTES = 200 * 1024 * 1024
+COALESCE_WAIT = 0.05
+COALESCE_MAX_IMAGES = 4 * DEFAULT_BATCH_SIZE
+# เวลารอผล AI สูงสุดต่อ request ก่อนตอบ 504
+REQUEST_TIMEOUT = 300
+
+
+class BadRequest(Exception):
+    pass
+
+
+# ---------------------------------------------------------
+# Multipart
+# ---------------------------------------------------------
+def parse_multipart(content_type, body):
+    """``(fields, files)`` from a multipart/form-data body; ``files`` = ``[(filename, bytes)]``."""
+    if not content_type or not content_type.startswith("multipart/form-data"):
+        raise BadRequest("expected multipart/form-data")
+    message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+        b"Content-Type: " + content_type.encode("latin-1") + b"\r\n\r\n" + body)
+    if not message.is_multipart():
+        raise BadRequest("malformed multipart body")
+    fields, files = {}, []
+    for part in message.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        payload = part.get_payload(decode=True) or b""
+        if part.get_filename() is not None:
+            files.append((part.get_filename(), payload))
+        elif name:
+            fields[name] = payload.decode("utf-8")
+    return fields, files
+
+
+def encode_multipart(fields, files):
+    """``(content_type, body)`` for ``fields`` (dict) and ``files`` (``[(filename, bytes)]``)."""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'
+                     .encode("utf-8"))
+    for filename, data in files:
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="image"; filename="{filename}"\r\n'
+                     f'Content-Type: application/octet-stream\r\n\r\n'.encode("utf-8") + data + b"\r\n")
+    parts.append(f"--{boundary}--\r\n".encode("utf-8"))
+    return f"multipart/form-data; boundary={boundary}", b"".join(parts)
+
+
+# ---------------------------------------------------------
+# Batch coalescing
+# ---------------------------------------------------------
+class _Pending:
+    def __init__(self, images, digests, conf):
+        self.images = images
+        self.digests = digests
+        self.conf = conf
+        self.future = Future()
+
+
+class BatchCoalescer:
+    """Merges the images of concurrent requests into shared inference jobs."""
+
+    def __init__(self, inference_queue, max_wait=COALESCE_WAIT, max_images=COALESCE_MAX_IMAGES):
+        self.inference_queue = inference_queue
+        self.max_wait = max_wait
+        self.max_images = max_images
+        self._pending = queue.Queue()
+        threading.Thread(target=self._run, name="ingest-coalescer", daemon=True).start()
+
+    def infer(self, images, digests, conf=DEFAULT_CONF, timeout=REQUEST_TIMEOUT):
+        """Results (dicts as in ``InferenceJob.results``) for ``images``, in order."""
+        pending = _Pending(images, digests, conf)
+        self._pending.put(pending)
+        return pending.future.result(timeout=timeout)
+
+    def _run(self):
+        while True:
+            batch = [self._pending.get()]
+            size = len(batch[0].images)
+            deadline = time.monotonic() + self.max_wait
+            while size < self.max_images:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._pending.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(item)
+                size += len(item.images)
+            # one job per confidence level (almost always just one)
+            by_conf = {}
+            for item in batch:
+                by_conf.setdefault(item.conf, []).append(item)
+            for conf, items in by_conf.items():
+                self._dispatch(conf, items)
+
+    def _dispatch(self, conf, items):
+        try:
+            job = self.inference_queue.submit(
+                [image for item in items for image in item.images], conf=conf,
+                batch_size=DEFAULT_BATCH_SIZE, digests=[d for item in items for d in item.digests])
+        except QueueFull as e:
+            for item in items:
+                item.future.set_exception(e)
+            return
+        job.add_done_callback(lambda job: self._deliver(job, items))
+
+    @staticmethod
+    def _deliver(job, items):
+        start = 0
+        for item in items:
+            if job.status == "error":
+                item.future.set_exception(RuntimeError(str(job.error)))
+            else:
+                item.future.set_result(job.results[start:start + len(item.images)])
+            start += len(item.images)
+
+
+# ---------------------------------------------------------
+# Service
+# ---------------------------------------------------------
+class IngestService:
+    def __init__(self, store, inference_queue, cache, img_dir=IMG_DIR):
+        self.store = store
+        self.inference_queue = inference_queue
+        self.cache = cache
+        self.img_dir = img_dir
+        self.spatial = SpatialIndex()
+        store.add_listener(self.spatial)
+        self.coalescer = BatchCoalescer(inference_queue)
+        # find_incident + put ต้องไม่สลับกันระหว่าง request ไม่งั้นรายงานจุดเดียวกันจะไม่ถูกรวม
+        self._save_lock = threading.Lock()
+        os.makedirs(img_dir, exist_ok=True)
+
+    def ingest(self, fields, files):
+        """Analyse and save every uploaded image; returns the response payload."""
+        try:
+            lat, lon = float(fields["lat"]), float(fields["lon"])
+            conf = float(fields.get("conf", DEFAULT_CONF))
+        except (KeyError, ValueError):
+            raise BadRequest("lat and lon are required numbers (conf optional)") from None
+        if not files:
+            raise BadRequest("no image files in the request")
+        images = []
+        for filename, data in files:
+            try:
+                images.append(PIL.ImageOps.exif_transpose(PIL.Image.open(io.BytesIO(data))).convert("RGB"))
+            except Exception:
+                raise BadRequest(f"{filename} is not an image") from None
+
+        results = self.coalescer.infer(images, [image_digest(data) for _, data in files], conf)
+
+        reports = []
+        with self._save_lock:
+            # ให้ index/ID เห็นรายงานที่แอป (process อื่น) เพิ่งบันทึก
+            self.store.refresh()
+            for (filename, data), result in zip(files, results):
+                reports.append(self._save(filename, data, result, lat, lon, conf, fields))
+        return {"reports": reports}
+
+    def _save(self, filename, data, result, lat, lon, conf, fields):
+        with metrics.timer("save"):
+            report, duplicate = submit_photo(
+                self.store, self.cache, data, lat, lon, result["count"], result["details"],
+                note=fields.get("note", ""), email=fields.get("email", ""), img_dir=self.img_dir,
+                spatial=self.spatial, conf=conf)
+        return {
+            "file": filename,
+            "id": report["id"],
+            "status": report["status"],
+            "count": report["count"],
+            "details": report["details"],
+            "severity": report["severity"],
+            "incident_id": report.get("incident_id", report["id"]),
+            "duplicate": {"id": duplicate[0], "kind": duplicate[1]} if duplicate else None,
+        }
+
+    def report_status(self, report_id):
+        self.store.refresh()
+        report = self.store.get(report_id)
+        if report is None:
+            return None
+        return {k: report.get(k) for k in ("id", "date", "status", "severity", "count", "incident_id")}
+
+    def health(self):
+        return {"status": "error" if self.inference_queue.load_error else "ok",
+                "ready": self.inference_queue.ready,
+                "model_error": str(self.inference_queue.load_error) if self.inference_queue.load_error else None,
+                "queue_depth": self.inference_queue.depth, "workers_busy": self.inference_queue.busy}
+
+
+def make_server(service, host="127.0.0.1", port=DEFAULT_PORT):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status, payload, content_type="application/json"):
+            body = payload if isinstance(payload, bytes) else json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            if status == 503:
+                self.send_header("Retry-After", "5")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            path = self.path.split("?")[0].rstrip("/")
+            if path == "/healthz":
+                self._send(200, service.health())
+            elif path == "/readyz":
+                self._send(200 if service.inference_queue.ready else 503, service.health())
+            elif path == "/metrics":
+                self._send(200, metrics.render().encode("utf-8"), "text/plain; version=0.0.4; charset=utf-8")
+            elif path.startswith("/v1/reports/") and path.rsplit("/", 1)[1].isdigit():
+                status = service.report_status(int(path.rsplit("/", 1)[1]))
+                if status is None:
+                    self._send(404, {"error": "report not found"})
+                else:
+                    self._send(200, status)
+            else:
+                self._send(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path.split("?")[0].rstrip("/") != "/v1/reports":
+                self._send(404, {"error": "not found"})
+                return
+            length = int(self.headers.get("Content-Length") or 0)
+            if length > MAX_UPLOAD_BYTES:
+                self._send(413, {"error": f"upload larger than {MAX_UPLOAD_BYTES} bytes"})
+                return
+            try:
+                with metrics.timer("ingest_request"):
+                    fields, files = parse_multipart(self.headers.get("Content-Type"), self.rfile.read(length))
+                    self._send(201, service.ingest(fields, files))
+            except BadRequest as e:
+                self._send(400, {"error": str(e)})
+            except QueueFull as e:
+                self._send(503, {"error": str(e)})
+            except TimeoutError:
+                self._send(504, {"error": "inference timed out"})
+            except Exception as e:
+                self._send(500, {"error": str(e)})
+
+        def log_message(self, format, *args):
+            pass
+
+    return ThreadingHTTPServer((host, port), Handler)
+
+
+# ---------------------------------------------------------
+# CLI
+# ---------------------------------------------------------
+def send(url, paths, lat, lon, note=""):
+    """Upload ``paths`` in one request to a running service; returns the decoded response."""
+    files = []
+    for path in paths:
+        with open(path, "rb") as f:
+            files.append((os.path.basename(path), f.read()))
+    content_type, body = encode_multipart({"lat": lat, "lon": lon, "note": note}, files)
+    request = urllib.request.Request(f"{url.rstrip('/')}/v1/reports", data=body,
+                                     headers={"Content-Type": content_type}, method="POST")
+    with urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT) as response:
+        return json.loads(response.read())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_serve = sub.add_parser("serve", help="run the ingest service")
+    p_serve.add_argument("--host", default="127.0.0.1",
+                         help="interface to bind; no auth built in, expose only behind an authenticating proxy")
+    p_serve.add_argument("--port", type=int, default=DEFAULT_PORT)
+    p_serve.add_argument("--store", default=os.environ.get("REPORT_STORE", "json"), choices=["json", "sqlite"])
+    p_serve.add_argument("--db", default="data_reports.json")
+    p_serve.add_argument("--workers", type=int, default=int(os.environ.get("INFERENCE_WORKERS", "1")))
+    p_serve.add_argument("--max-pending", type=int, default=int(os.environ.get("INFERENCE_MAX_PENDING", "16")))
+    p_send = sub.add_parser("send", help="upload images to a running service")
+    p_send.add_argument("url")
+    p_send.add_argument("images", nargs="+")
+    p_send.add_argument("--lat", type=float, required=True)
+    p_send.add_argument("--lon", type=float, required=True)
+    p_send.add_argument("--note", default="")
+    args = parser.parse_args(argv)
+
+    if args.command == "send":
+        print(json.dumps(send(args.url, args.images, args.lat, args.lon, args.note), ensure_ascii=False, indent=2))
+        return 0
+
+    cache = ResultCache(model_tag=model_tag())
+    service = IngestService(open_store(args.store, args.db),
+                            InferenceQueue(load_yolo, workers=args.workers, max_pending=args.max_pending,
+                                           cache=cache),
+                            cache)
+    server = make_server(service, args.host, args.port)
+    print(f"ingest service on http://{args.host}:{args.port}/v1/reports")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
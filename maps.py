@@ -0,0 +1,117 @@
+"""Server-side clustering for the admin map.
+
+Reports are binned into a lat/lon grid whose cell size follows the map zoom
+(``CELLS_PER_TILE`` cells across one web-map tile), and only the cells inside
+the current viewport are sent to the browser. Each zoom level is binned once
+per ``ClusterIndex`` and reused until the index is rebuilt, so panning is a
+dictionary lookup per visible cell rather than a pass over every report.
+"""
+import math
+from collections import Counter
+
+import folium
+from folium.plugins import HeatMap
+
+MIN_ZOOM = 3
+MAX_ZOOM = 18
+CELLS_PER_TILE = 6
+# ตั้งแต่ zoom นี้ขึ้นไปแสดงหมุดรายงานทีละจุด
+SINGLE_MARKER_ZOOM = 16
+HEATMAP_ZOOM = 13
+
+STATUS_COLORS = {"รอรับเรื่อง": "red", "กำลังดำเนินการ": "orange", "เสร็จสิ้น": "green"}
+
+
+def cell_size(zoom):
+    return 360.0 / (2 ** zoom) / CELLS_PER_TILE
+
+
+class ClusterIndex:
+    def __init__(self, reports):
+        self._points = [(r['lat'], r['lon'], r['id'], r['status'], r['severity']) for r in reports]
+        self._levels = {}
+
+    def __len__(self):
+        return len(self._points)
+
+    def _level(self, zoom):
+        zoom = max(MIN_ZOOM, min(MAX_ZOOM, zoom))
+        if zoom not in self._levels:
+            size = cell_size(zoom)
+            cells = {}
+            for lat, lon, report_id, status, severity in self._points:
+                key = (math.floor(lat / size), math.floor(lon / size))
+                cell = cells.get(key)
+                if cell is None:
+                    cells[key] = {"lat": lat, "lon": lon, "count": 1, "statuses": Counter([status]),
+                                  "id": report_id, "status": status, "severity": severity}
+                else:
+                    n = cell["count"]
+                    cell["lat"] += (lat - cell["lat"]) / (n + 1)
+                    cell["lon"] += (lon - cell["lon"]) / (n + 1)
+                    cell["count"] = n + 1
+                    cell["statuses"][status] += 1
+            self._levels[zoom] = (size, cells)
+        return self._levels[zoom]
+
+    def query(self, zoom, bounds=None):
+        """Clusters at ``zoom`` inside ``bounds`` = ``(south, west, north, east)`` (``None`` = all)."""
+        size, cells = self._level(zoom)
+        if bounds is None:
+            return list(cells.values())
+        south, west, north, east = bounds
+        y0, y1 = math.floor(south / size), math.floor(north / size)
+        x0, x1 = math.floor(west / size), math.floor(east / size)
+        if (y1 - y0 + 1) * (x1 - x0 + 1) > len(cells):
+            return [c for (y, x), c in cells.items() if y0 <= y <= y1 and x0 <= x <= x1]
+        return [cells[(y, x)] for y in range(y0, y1 + 1) for x in range(x0, x1 + 1) if (y, x) in cells]
+
+
+def snap_bounds(bounds, zoom):
+    """Round ``bounds`` outwards to whole cells so small pans reuse cached results."""
+    if bounds is None:
+        return None
+    size = cell_size(max(MIN_ZOOM, min(MAX_ZOOM, zoom)))
+    south, west, north, east = bounds
+    return (math.floor(south / size) * size, math.floor(west / size) * size,
+            math.ceil(north / size) * size, math.ceil(east / size) * size)
+
+
+def viewport(map_state):
+    """``(zoom, bounds)`` from the dict ``st_folium`` returns, or ``(None, None)``."""
+    if not map_state or not map_state.get("zoom") or not map_state.get("bounds"):
+        return None, None
+    sw, ne = map_state["bounds"].get("_southWest"), map_state["bounds"].get("_northEast")
+    if not sw or not ne or sw.get("lat") is None:
+        return map_state["zoom"], None
+    return map_state["zoom"], (sw["lat"], sw["lng"], ne["lat"], ne["lng"])
+
+
+def marker_layer(clusters, zoom):
+    layer = folium.FeatureGroup(name="reports")
+    for c in clusters:
+        if c["count"] == 1 or zoom >= SINGLE_MARKER_ZOOM:
+            folium.Marker(
+                [c["lat"], c["lon"]],
+                popup=f"#{c['id']} ({c['severity']})" if c["count"] == 1 else f"{c['count']} งาน",
+                icon=folium.Icon(color=STATUS_COLORS.get(c["status"], "green") if c["count"] == 1 else "blue")
+            ).add_to(layer)
+            continue
+        # สีตามสถานะที่มีมากที่สุดในกลุ่ม
+        color = STATUS_COLORS.get(c["statuses"].most_common(1)[0][0], "green")
+        summary = "<br>".join(f"{s}: {n}" for s, n in c["statuses"].items())
+        folium.CircleMarker(
+            [c["lat"], c["lon"]],
+            radius=min(30, 8 + 4 * math.log2(c["count"])),
+            color=color, fill=True, fill_opacity=0.6,
+            tooltip=f"{c['count']} งาน",
+            popup=folium.Popup(f"<b>{c['count']} งาน</b><br>{summary}", max_width=200),
+        ).add_to(layer)
+    return layer
+
+
+def heatmap_map(clusters, center, zoom_start=11):
+    """Heatmap weighted by cell counts, so its size tracks occupied cells, not reports."""
+    m = folium.Map(location=center, zoom_start=zoom_start)
+    HeatMap([[c["lat"], c["lon"], c["count"]] for c in clusters], radius=15).add_to(m)
+    return m
@@ -0,0 +1,218 @@
+"""Process metrics: phase timing histograms, gauges and Prometheus text export.
+
+    with metrics.timer("data_load"):
+        store.refresh()
+
+Every timed phase goes into the histogram ``waste_phase_seconds{phase="..."}``.
+Besides the cumulative buckets Prometheus needs, each phase keeps its most
+recent ``RECENT_SAMPLES`` durations so the admin panel can show p50/p95 without
+a Prometheus server. ``render()`` produces the text exposition format; it is
+served by ``serve()`` on ``/metrics`` and/or written to a file by
+``write_file()`` (for node_exporter's textfile collector).
+"""
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import psutil
+except ImportError:  # /proc and getrusage fallbacks below
+    psutil = None
+
+try:
+    import resource
+except ImportError:  # Windows: no getrusage; memory_mb() needs psutil there
+    resource = None
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+RECENT_SAMPLES = 1024
+PREFIX = "waste"
+CPU_SAMPLE_INTERVAL = 5.0
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=RECENT_SAMPLES)
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def quantile(self, q):
+        """``q`` quantile of the recent samples (seconds), ``None`` before any sample."""
+        samples = sorted(self.recent)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}   # phase -> Histogram
+        self._gauges = {}       # name -> (help, fn)
+
+    def observe(self, phase, seconds):
+        with self._lock:
+            histogram = self._histograms.get(phase)
+            if histogram is None:
+                histogram = self._histograms[phase] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, phase):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(phase, time.perf_counter() - started)
+
+    def gauge(self, name, help_text, fn):
+        """Register ``fn()`` as a gauge, read on every export."""
+        with self._lock:
+            self._gauges[name] = (help_text, fn)
+
+    def percentiles(self, phase):
+        """``(p50, p95, count)`` of a phase in seconds; ``(None, None, 0)`` if never timed."""
+        with self._lock:
+            histogram = self._histograms.get(phase)
+            if histogram is None:
+                return None, None, 0
+            return histogram.quantile(0.5), histogram.quantile(0.95), histogram.count
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)."""
+        name = f"{PREFIX}_phase_seconds"
+        lines = [f"# HELP {name} Duration of instrumented phases.", f"# TYPE {name} histogram"]
+        with self._lock:
+            for phase, h in sorted(self._histograms.items()):
+                cumulative = 0
+                for bound, count in zip(h.buckets, h.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{phase="{phase}",le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{phase="{phase}",le="+Inf"}} {h.count}')
+                lines.append(f'{name}_sum{{phase="{phase}"}} {h.sum:.6f}')
+                lines.append(f'{name}_count{{phase="{phase}"}} {h.count}')
+            gauges = list(self._gauges.items())
+        for gauge_name, (help_text, fn) in gauges:
+            try:
+                value = fn()
+            except Exception:
+                continue
+            if value is None:
+                continue
+            lines += [f"# HELP {PREFIX}_{gauge_name} {help_text}", f"# TYPE {PREFIX}_{gauge_name} gauge",
+                      f"{PREFIX}_{gauge_name} {value}"]
+        return "\n".join(lines) + "\n"
+
+    def write_file(self, path):
+        # atomic: the textfile collector may read at any moment
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(f"{path}.tmp", path)
+
+    def serve(self, port, host="0.0.0.0"):
+        """Serve ``/metrics`` from a daemon thread; returns the server."""
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+        return server
+
+    def write_every(self, path, interval=15):
+        def loop():
+            while True:
+                try:
+                    self.write_file(path)
+                except OSError:
+                    pass
+                time.sleep(interval)
+        threading.Thread(target=loop, name="metrics-file", daemon=True).start()
+
+
+# ---------------------------------------------------------
+# Process stats (CPU %, memory)
+# ---------------------------------------------------------
+# one sampler thread per process; the sidebar and every scrape read the same value
+_cpu_lock = threading.Lock()
+_cpu_sampler = None
+_cpu_value = 0.0
+
+
+def _sample_cpu(interval):
+    global _cpu_value
+    # process_time() = user + system CPU of this process, on every platform
+    last = (time.monotonic(), time.process_time())
+    while True:
+        time.sleep(interval)
+        now = (time.monotonic(), time.process_time())
+        if now[0] > last[0]:
+            _cpu_value = 100.0 * (now[1] - last[1]) / (now[0] - last[0])
+        last = now
+
+
+def cpu_percent():
+    """Process CPU use over the last ``CPU_SAMPLE_INTERVAL`` seconds, in percent of one core.
+
+    The first call starts the background sampler and returns 0 until it has
+    completed one interval.
+    """
+    global _cpu_sampler
+    with _cpu_lock:
+        if _cpu_sampler is None:
+            _cpu_sampler = threading.Thread(target=_sample_cpu, args=(CPU_SAMPLE_INTERVAL,),
+                                            name="metrics-cpu", daemon=True)
+            _cpu_sampler.start()
+    return _cpu_value
+
+
+def memory_mb():
+    """Resident memory of this process in MB; ``None`` if it can't be read (Windows without psutil)."""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / (1024 * 1024)
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError):
+        if resource is None:
+            return None
+        # peak, not current, but better than nothing off Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+REGISTRY = Registry()
+observe = REGISTRY.observe
+timer = REGISTRY.timer
+gauge = REGISTRY.gauge
+percentiles = REGISTRY.percentiles
+render = REGISTRY.render
+
+gauge("process_cpu_percent", f"Process CPU use over the last {CPU_SAMPLE_INTERVAL:g}s (% of one core).", cpu_percent)
+gauge("process_resident_memory_mb", "Resident memory of the process in MB.", memory_mb)
@@ -0,0 +1,786 @@
+"""Report storage backends.
+
+``JournalStore`` (default) keeps the snapshot (``data_reports.json``) in the same
+list-of-dicts format the app has always written. Every mutation after that is
+appended as one JSON line to ``<snapshot>.journal.jsonl``; ``load()`` replays
+snapshot + journal, and once the journal grows past ``compact_bytes`` a
+background thread folds it back into a fresh snapshot.
+
+``SqliteStore`` keeps reports in an indexed SQLite table so filters, counts and
+ID lookups are queries instead of scans. Pick one with ``open_store()``.
+
+Both stores are safe to share between threads and carry a ``version`` counter
+that goes up on every change. ``refresh()`` picks up writes made by other
+processes: the journal store reads only the new journal tail, the SQLite store
+checks a version row and replays a short log of changed rows, both maintained
+by triggers.
+
+Derived indexes register with ``add_listener()``. A listener has
+``rebuild(reports)``, called with every report when it is added and whenever
+the store had to reload wholesale, and ``apply(old, new)``, called for each
+single change (``old`` is ``None`` for an insert, ``new`` is ``None`` for a
+delete).
+"""
+import bisect
+import heapq
+import itertools
+import json
+import math
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to in-process locking only
+    fcntl = None
+
+# ตั้งค่า compaction: ขนาด journal (bytes) ก่อนรวมเป็น snapshot ใหม่
+COMPACT_BYTES = 256 * 1024
+
+REPORT_FIELDS = ("id", "date", "lat", "lon", "count", "details", "severity",
+                 "note", "email", "status", "image_path")
+
+# SQLite: จำนวนการเปลี่ยนแปลงล่าสุดที่เก็บไว้ให้ process อื่นตามทัน (ช้ากว่านี้ = โหลดใหม่ทั้งหมด)
+CHANGE_LOG_SIZE = 1000
+
+# ลำดับความรุนแรงสำหรับ page(order="severity") (ค่าเดียวกับ inference.SEVERITY_*)
+SEVERITY_RANK = {"🔴 วิกฤต": 0, "🟠 ปานกลาง": 1, "🟢 เล็กน้อย": 2}
+PAGE_ORDERS = ("newest", "severity", "distance")
+
+_thread_lock = threading.RLock()
+_compacting = set()
+
+
+@contextmanager
+def _file_lock(lock_path, exclusive):
+    """Hold an advisory flock on ``lock_path`` (shared or exclusive)."""
+    with _thread_lock:
+        with open(lock_path, 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _atomic_write(path, text):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _read_snapshot(path):
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return []
+
+
+def _apply_event(reports, event):
+    """Apply one journal event; returns ``(old, new)`` (both ``None`` if nothing changed)."""
+    op = event.get('op')
+    if op == 'put':
+        report = event['report']
+        old = reports.get(report['id'])
+        reports[report['id']] = report
+        return old, report
+    elif op == 'delete':
+        return reports.pop(event['id'], None), None
+    return None, None
+
+
+def _parse_journal(data):
+    """Return ``(events, consumed_bytes)`` for the complete lines in ``data``.
+
+    A torn trailing line from a crashed write has no newline yet; it is left
+    unconsumed so a later read can pick it up once the line is finished.
+    """
+    events = []
+    consumed = data.rfind(b'\n') + 1
+    for line in data[:consumed].splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            events.append(json.loads(line))
+        except json.JSONDecodeError:
+            continue
+    return events, consumed
+
+
+def _read_journal(path, offset=0):
+    """Read journal events from ``offset``; returns ``(events, new_offset, inode)``."""
+    if not os.path.exists(path):
+        return [], 0, None
+    with open(path, 'rb') as f:
+        inode = os.fstat(f.fileno()).st_ino
+        f.seek(offset)
+        events, consumed = _parse_journal(f.read())
+    return events, offset + consumed, inode
+
+
+def _matches(report, statuses, severities, primary_only=False):
+    return ((statuses is None or report['status'] in statuses)
+            and (severities is None or report['severity'] in severities)
+            and (not primary_only or report.get('incident_id', report['id']) == report['id']))
+
+
+def _lon_scale(near):
+    # equirectangular approximation: good enough to rank distances within a city
+    return math.cos(math.radians(near[0])) ** 2
+
+
+def _sort_key(order, near):
+    if order == "severity":
+        return lambda r: (SEVERITY_RANK.get(r['severity'], len(SEVERITY_RANK)), -r['id'])
+    if order == "distance" and near is not None:
+        scale = _lon_scale(near)
+        return lambda r: ((r['lat'] - near[0]) ** 2 + (r['lon'] - near[1]) ** 2 * scale, -r['id'])
+    return lambda r: -r['id']
+
+
+class JournalStore:
+    def __init__(self, path, compact_bytes=COMPACT_BYTES):
+        self.path = path
+        self.journal_path = f"{os.path.splitext(path)[0]}.journal.jsonl"
+        self.lock_path = f"{path}.lock"
+        self.seq_path = f"{path}.seq"
+        self.compact_bytes = compact_bytes
+        self.version = 0
+        self._lock = threading.RLock()
+        self._reports = None
+        self._max_id = 0
+        self._members = {}  # incident_id -> ids of reports merged into it
+        # (status, severity, is_primary) -> sorted ids: count()/page() touch only matching buckets
+        self._buckets = {}
+        self._journal_offset = 0
+        self._journal_inode = None
+        self._listeners = []
+
+    def add_listener(self, listener):
+        with self._lock:
+            self._listeners.append(listener)
+            listener.rebuild(self.reports.values())
+
+    def _apply(self, event):
+        old, new = _apply_event(self._reports, event)
+        if new is not None and new['id'] > self._max_id:
+            self._max_id = new['id']
+        if old is not None:
+            self._index_member(old, add=False)
+            self._index_bucket(old, add=False)
+        if new is not None:
+            self._index_member(new, add=True)
+            self._index_bucket(new, add=True)
+        if old is not None or new is not None:
+            for listener in self._listeners:
+                listener.apply(old, new)
+
+    def _replay(self):
+        reports = {r['id']: r for r in _read_snapshot(self.path)}
+        events, offset, inode = _read_journal(self.journal_path)
+        for event in events:
+            _apply_event(reports, event)
+        return reports, offset, inode
+
+    def _reload(self):
+        self._reports, self._journal_offset, self._journal_inode = self._replay()
+        self._max_id = max(self._max_id, max(self._reports, default=0))
+        self._members = {}
+        self._buckets = {}
+        for report in sorted(self._reports.values(), key=lambda r: r['id']):
+            self._index_member(report, add=True)
+            self._index_bucket(report, add=True)
+        self.version += 1
+        for listener in self._listeners:
+            listener.rebuild(self._reports.values())
+
+    def _index_member(self, report, add):
+        incident_id = report.get('incident_id')
+        if incident_id is None or incident_id == report['id']:
+            return
+        if add:
+            self._members.setdefault(incident_id, set()).add(report['id'])
+        else:
+            members = self._members.get(incident_id, set())
+            members.discard(report['id'])
+            if not members:
+                self._members.pop(incident_id, None)
+
+    def _index_bucket(self, report, add):
+        key = (report['status'], report['severity'], report.get('incident_id', report['id']) == report['id'])
+        ids = self._buckets.setdefault(key, [])
+        i = bisect.bisect_left(ids, report['id'])
+        if add:
+            if i == len(ids) or ids[i] != report['id']:
+                ids.insert(i, report['id'])
+        elif i < len(ids) and ids[i] == report['id']:
+            del ids[i]
+            if not ids:
+                del self._buckets[key]
+
+    def _matching_buckets(self, statuses, severities, primary_only):
+        return [(key, ids) for key, ids in self._buckets.items()
+                if (statuses is None or key[0] in statuses) and (severities is None or key[1] in severities)
+                and (key[2] or not primary_only)]
+
+    def _catch_up(self):
+        """Apply journal lines written since our last read (caller holds the file lock)."""
+        try:
+            stat = os.stat(self.journal_path)
+        except FileNotFoundError:
+            stat = None
+        if stat is None or stat.st_ino != self._journal_inode or stat.st_size < self._journal_offset:
+            # compaction ได้สร้าง journal ไฟล์ใหม่ -> โหลด snapshot ใหม่ทั้งหมด
+            if stat is not None or self._journal_inode is not None:
+                self._reload()
+            return
+        if stat.st_size == self._journal_offset:
+            return
+        events, self._journal_offset, _ = _read_journal(self.journal_path, self._journal_offset)
+        for event in events:
+            self._apply(event)
+        if events:
+            self.version += 1
+
+    @property
+    def reports(self):
+        with self._lock:
+            if self._reports is None:
+                with _file_lock(self.lock_path, exclusive=False):
+                    self._reload()
+            return self._reports
+
+    def refresh(self):
+        """Pick up writes from other processes; returns the current version."""
+        with self._lock:
+            if self._reports is None:
+                self.reports
+            else:
+                with _file_lock(self.lock_path, exclusive=False):
+                    self._catch_up()
+            return self.version
+
+    def load(self):
+        with self._lock:
+            return list(self.reports.values())
+
+    def _append(self, event):
+        line = json.dumps(event, ensure_ascii=False) + '\n'
+        self.reports
+        with self._lock, _file_lock(self.lock_path, exclusive=True):
+            self._catch_up()
+            with open(self.journal_path, 'a+b') as f:
+                # ถ้าบรรทัดสุดท้ายเขียนไม่จบ (process ตายกลางทาง) ให้ขึ้นบรรทัดใหม่ก่อน
+                if f.tell() > 0:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b'\n':
+                        line = '\n' + line
+                f.write(line.encode('utf-8'))
+                f.flush()
+                os.fsync(f.fileno())
+                journal_size = f.tell()
+                self._journal_inode = os.fstat(f.fileno()).st_ino
+            self._journal_offset = journal_size
+            self._apply(event)
+            self.version += 1
+        if journal_size > self.compact_bytes:
+            self.compact_in_background()
+
+    def next_id(self):
+        """Reserve a new report ID; IDs are never reused, even after a delete."""
+        self.reports
+        with self._lock, _file_lock(self.lock_path, exclusive=True):
+            # ไม่มีไฟล์ .seq (ข้อมูลเก่า) ก็ยังได้ ID ใหม่จาก ID สูงสุดที่เคยเห็น (_max_id)
+            self._catch_up()
+            last_id = 0
+            if os.path.exists(self.seq_path):
+                with open(self.seq_path, 'r', encoding='utf-8') as f:
+                    last_id = int(f.read().strip() or 0)
+            new_id = max(last_id, self._max_id) + 1
+            _atomic_write(self.seq_path, str(new_id))
+        return new_id
+
+    def put(self, report):
+        """Insert or replace one report."""
+        self._append({'op': 'put', 'report': report})
+
+    def delete(self, report_id):
+        self._append({'op': 'delete', 'id': report_id})
+
+    # Reports handed out below are shared by every session: treat them as
+    # read-only and write changes back with put().
+    def get(self, report_id):
+        with self._lock:
+            return self.reports.get(report_id)
+
+    def latest(self):
+        with self._lock:
+            if not self.reports:
+                return None
+            return self.reports[max(self.reports)]
+
+    def query(self, statuses=None, severities=None, primary_only=False):
+        """Reports matching the filters; ``primary_only`` hides reports merged into another incident."""
+        with self._lock:
+            return [r for r in self.reports.values() if _matches(r, statuses, severities, primary_only)]
+
+    def incident_members(self, incident_id):
+        """Reports merged into ``incident_id`` (not including the incident's own report)."""
+        with self._lock:
+            reports = self.reports
+            return [reports[i] for i in sorted(self._members.get(incident_id, ()))]
+
+    def page(self, statuses=None, severities=None, primary_only=False, order="newest",
+             offset=0, limit=20, near=None):
+        """One page of ``query()`` sorted by ``order`` (see ``PAGE_ORDERS``).
+
+        ``near`` = ``(lat, lon)`` is the reference point for ``"distance"``;
+        without it that order falls back to newest first. Newest and severity
+        pages merge the per-(status, severity) id lists, so their cost depends
+        on ``offset + limit``; distance still scans the matching reports.
+        """
+        with self._lock:
+            reports = self.reports
+            buckets = self._matching_buckets(statuses, severities, primary_only)
+            if order == "distance" and near is not None:
+                matches = (reports[i] for _, ids in buckets for i in ids)
+                return heapq.nsmallest(offset + limit, matches, key=_sort_key(order, near))[offset:]
+            if order == "severity":
+                # newest first within each rank (unknown severities share the last rank)
+                by_rank = {}
+                for key, ids in buckets:
+                    by_rank.setdefault(SEVERITY_RANK.get(key[1], len(SEVERITY_RANK)), []).append(reversed(ids))
+                ordered = itertools.chain(*(heapq.merge(*by_rank[rank], reverse=True) for rank in sorted(by_rank)))
+            else:
+                ordered = heapq.merge(*(reversed(ids) for _, ids in buckets), reverse=True)
+            return [reports[i] for i in itertools.islice(ordered, offset, offset + limit)]
+
+    def iter_query(self, statuses=None, severities=None, chunk_size=1000):
+        """``query()`` in ID order, yielded as lists of at most ``chunk_size`` reports."""
+        with self._lock:
+            ids = sorted(r['id'] for r in self.reports.values() if _matches(r, statuses, severities))
+        for start in range(0, len(ids), chunk_size):
+            with self._lock:
+                chunk = [self.reports.get(i) for i in ids[start:start + chunk_size]]
+            yield [r for r in chunk if r is not None]
+
+    def count(self, statuses=None, severities=None, primary_only=False):
+        with self._lock:
+            if statuses is None and severities is None and not primary_only:
+                return len(self.reports)
+            self.reports
+            return sum(len(ids) for _, ids in self._matching_buckets(statuses, severities, primary_only))
+
+    def count_by(self, field):
+        counts = {}
+        with self._lock:
+            for r in self.reports.values():
+                counts[r[field]] = counts.get(r[field], 0) + 1
+        return counts
+
+    def compact(self):
+        """Fold the journal into a new snapshot and start an empty journal.
+
+        The snapshot is serialized from a copy of the in-memory reports without
+        holding any lock; the locks are only taken to swap the files in.
+        """
+        with self._lock:
+            with _file_lock(self.lock_path, exclusive=False):
+                if self._reports is None:
+                    self._reload()
+                else:
+                    self._catch_up()
+            reports = list(self._reports.values())
+            offset, inode = self._journal_offset, self._journal_inode
+        # เขียน snapshot ลงไฟล์ชั่วคราวก่อน (งานหนัก) ระหว่างนี้ session อื่นยังอ่าน/เขียนได้ตามปกติ
+        tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(reports, ensure_ascii=False, indent=4))
+            f.flush()
+            os.fsync(f.fileno())
+
+        with self._lock, _file_lock(self.lock_path, exclusive=True):
+            try:
+                stat = os.stat(self.journal_path)
+            except FileNotFoundError:
+                stat = None
+            if (stat.st_ino if stat else None) != inode:
+                # process อื่น compact ไปก่อนแล้ว
+                os.remove(tmp_path)
+                return
+            if stat is None:
+                os.replace(tmp_path, self.path)
+                return
+            self._catch_up()
+            # events written while we serialized stay in the new journal
+            with open(self.journal_path, 'rb') as f:
+                f.seek(offset)
+                tail = f.read()
+            with open(f"{self.journal_path}.tmp", 'wb') as f:
+                f.write(tail)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            # Crash between these two steps is harmless: replaying put/delete
+            # events on top of the new snapshot is idempotent.
+            os.replace(f"{self.journal_path}.tmp", self.journal_path)
+            # เนื้อหาในหน่วยความจำเท่าเดิม แค่ย้ายไปอยู่ใน snapshot ไม่ต้องโหลดใหม่
+            self._journal_offset -= offset
+            self._journal_inode = os.stat(self.journal_path).st_ino
+
+    def compact_in_background(self):
+        with _thread_lock:
+            if self.path in _compacting:
+                return
+            _compacting.add(self.path)
+
+        def run():
+            try:
+                self.compact()
+            finally:
+                with _thread_lock:
+                    _compacting.discard(self.path)
+
+        threading.Thread(target=run, name="report-compaction", daemon=True).start()
+
+
+# ---------------------------------------------------------
+# SQLite backend
+# ---------------------------------------------------------
+_COLUMNS = REPORT_FIELDS + ("extra", "incident_id")
+_SELECT = f"SELECT {', '.join(_COLUMNS)} FROM reports"
+_UPSERT = f"INSERT OR REPLACE INTO reports ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS reports (
+    id INTEGER PRIMARY KEY,
+    date TEXT,
+    lat REAL,
+    lon REAL,
+    count INTEGER,
+    details TEXT,
+    severity TEXT,
+    note TEXT,
+    email TEXT,
+    status TEXT,
+    image_path TEXT,
+    extra TEXT,
+    incident_id INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_reports_status ON reports(status);
+CREATE INDEX IF NOT EXISTS idx_reports_severity ON reports(severity);
+CREATE INDEX IF NOT EXISTS idx_reports_date ON reports(date);
+-- AUTOINCREMENT keeps a high-water mark in sqlite_sequence, so IDs never repeat
+CREATE TABLE IF NOT EXISTS report_ids (id INTEGER PRIMARY KEY AUTOINCREMENT);
+-- version ขยับทุกครั้งที่ตาราง reports เปลี่ยน (ทุก process) ใช้ตรวจว่าข้อมูลเก่าหรือยัง
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0);
+"""
+
+# One row per version: which report changed and its row *before* the change
+# (columns NULL for an insert), so refresh() can hand listeners (old, new).
+_CHANGES = f"""
+CREATE TABLE IF NOT EXISTS changes (
+    version INTEGER PRIMARY KEY,
+    report_id INTEGER,
+    {', '.join(_COLUMNS)}
+);
+-- triggers from before the change log only bumped the version
+DROP TRIGGER IF EXISTS reports_version_insert;
+DROP TRIGGER IF EXISTS reports_version_update;
+DROP TRIGGER IF EXISTS reports_version_delete;
+-- BEFORE: INSERT OR REPLACE removes the old row without firing the delete trigger
+CREATE TRIGGER IF NOT EXISTS reports_change_insert BEFORE INSERT ON reports
+BEGIN
+    UPDATE meta SET value = value + 1 WHERE key = 'version';
+    INSERT INTO changes (version, report_id, {', '.join(_COLUMNS)})
+    SELECT (SELECT value FROM meta WHERE key = 'version'), NEW.id, {', '.join('r.' + c for c in _COLUMNS)}
+    FROM (SELECT 1) LEFT JOIN reports r ON r.id = NEW.id;
+END;
+CREATE TRIGGER IF NOT EXISTS reports_change_update AFTER UPDATE ON reports
+BEGIN
+    UPDATE meta SET value = value + 1 WHERE key = 'version';
+    INSERT INTO changes (version, report_id, {', '.join(_COLUMNS)})
+    VALUES ((SELECT value FROM meta WHERE key = 'version'), OLD.id, {', '.join('OLD.' + c for c in _COLUMNS)});
+END;
+CREATE TRIGGER IF NOT EXISTS reports_change_delete AFTER DELETE ON reports
+BEGIN
+    UPDATE meta SET value = value + 1 WHERE key = 'version';
+    INSERT INTO changes (version, report_id, {', '.join(_COLUMNS)})
+    VALUES ((SELECT value FROM meta WHERE key = 'version'), OLD.id, {', '.join('OLD.' + c for c in _COLUMNS)});
+END;
+"""
+
+
+def _row_to_report(row):
+    report = dict(zip(REPORT_FIELDS, row[:len(REPORT_FIELDS)]))
+    # NULL = ยังไม่ผ่าน AI ({} = วิเคราะห์แล้วแต่ไม่พบอะไร)
+    report['details'] = json.loads(report['details']) if report['details'] is not None else None
+    report.update(json.loads(row[len(REPORT_FIELDS)] or '{}'))
+    if row[len(REPORT_FIELDS) + 1] is not None:
+        report['incident_id'] = row[len(REPORT_FIELDS) + 1]
+    return report
+
+
+def _report_to_row(report):
+    extra = {k: v for k, v in report.items() if k not in _COLUMNS}
+    row = [report.get(k) for k in REPORT_FIELDS]
+    if report.get('details') is not None:
+        row[REPORT_FIELDS.index('details')] = json.dumps(report['details'], ensure_ascii=False)
+    return row + [json.dumps(extra, ensure_ascii=False) if extra else None, report.get('incident_id')]
+
+
+def _where(statuses, severities, primary_only=False):
+    clauses, params = [], []
+    if statuses is not None:
+        clauses.append(f"status IN ({','.join('?' * len(statuses))})")
+        params.extend(statuses)
+    if severities is not None:
+        clauses.append(f"severity IN ({','.join('?' * len(severities))})")
+        params.extend(severities)
+    if primary_only:
+        clauses.append("(incident_id IS NULL OR incident_id = id)")
+    return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+
+class SqliteStore:
+    def __init__(self, path, seed_from=None):
+        self.path = path
+        self._local = threading.local()
+        # ผลนับ (KPI) จำไว้ตาม version; ล้างเมื่อ refresh() เห็นว่ามีการเขียน
+        self._memo = {}
+        self._memo_lock = threading.Lock()
+        self._write_lock = threading.RLock()
+        self._listeners = []
+        self.version = None
+        with self._conn() as conn:
+            conn.executescript(_SCHEMA)
+            # databases created before incidents existed
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(reports)")]
+            if "incident_id" not in columns:
+                conn.execute("ALTER TABLE reports ADD COLUMN incident_id INTEGER")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_reports_incident ON reports(incident_id)")
+            conn.executescript(_CHANGES)
+        if seed_from:
+            self._seed(seed_from)
+        self.refresh()
+
+    def _seed(self, seed_from):
+        # นำเข้าจาก JSON ครั้งเดียวตอนสร้างฐานข้อมูล ลบจนว่างแล้วเปิดใหม่ต้องไม่ดึงกลับมา
+        if self._conn().execute("SELECT 1 FROM meta WHERE key = 'seeded'").fetchone():
+            return
+        if os.path.exists(seed_from) and self.count() == 0:
+            self.import_reports(JournalStore(seed_from).load())
+        with self._conn() as conn:
+            conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('seeded', 1)")
+
+    def _read_version(self):
+        return self._conn().execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+
+    def add_listener(self, listener):
+        with self._write_lock:
+            self._listeners.append(listener)
+            listener.rebuild(self.load())
+
+    def _rebuild_listeners(self):
+        reports = self.load()
+        for listener in self._listeners:
+            listener.rebuild(reports)
+
+    def _set_version(self, version):
+        with self._memo_lock:
+            self._memo.clear()
+            self.version = version
+
+    def refresh(self):
+        """Pick up writes from other processes; returns the current version.
+
+        Listeners get one ``apply(old, new)`` per report changed since the last
+        check, from the ``changes`` log; they are rebuilt from the table only if
+        this store fell more than ``CHANGE_LOG_SIZE`` changes behind.
+        """
+        with self._write_lock:
+            version = self._read_version()
+            if version != self.version:
+                since = self.version
+                self._set_version(version)
+                if self._listeners:
+                    self._replay_changes(since, version)
+            return version
+
+    def _replay_changes(self, since, version):
+        rows = []
+        if since is not None and 0 < version - since <= CHANGE_LOG_SIZE:
+            rows = self._conn().execute(
+                f"SELECT report_id, {', '.join(_COLUMNS)} FROM changes WHERE version > ? AND version <= ? "
+                "ORDER BY version", (since, version)).fetchall()
+        if len(rows) != (version - since if since is not None else -1):
+            # ตามไม่ทัน (log ถูกตัดไปแล้ว หรือเพิ่งเปิด) -> สร้างใหม่จากตาราง
+            self._rebuild_listeners()
+            return
+        # the first logged row of a report is its state before all these changes
+        before = {}
+        for row in rows:
+            if row[0] not in before:
+                before[row[0]] = _row_to_report(row[1:]) if row[1] is not None else None
+        for report_id, old in before.items():
+            new = self.get(report_id)
+            if old is not None or new is not None:
+                for listener in self._listeners:
+                    listener.apply(old, new)
+
+    def _write(self, sql, params, report_id, new):
+        with self._write_lock:
+            with self._conn() as conn:
+                # แถวเดิมอ่านใน transaction เดียวกับการเขียน ไม่งั้น session/process อื่นแก้แทรกได้
+                conn.execute("BEGIN IMMEDIATE")
+                row = conn.execute(f"{_SELECT} WHERE id = ?", (report_id,)).fetchone() if self._listeners else None
+                conn.execute(sql, params)
+                version = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+            old = _row_to_report(row) if row else None
+            if version % 100 == 0:
+                with self._conn() as conn:
+                    conn.execute("DELETE FROM changes WHERE version <= ?", (version - CHANGE_LOG_SIZE,))
+            if self.version is not None and version == self.version + 1:
+                # only our own write since the last check: update listeners in place
+                self._set_version(version)
+                if old is not None or new is not None:
+                    for listener in self._listeners:
+                        listener.apply(old, new)
+            else:
+                self.refresh()
+
+    def _memoized(self, key, compute):
+        with self._memo_lock:
+            if key in self._memo:
+                return self._memo[key]
+            version = self.version
+        value = compute()
+        with self._memo_lock:
+            if self.version == version:
+                self._memo[key] = value
+        return value
+
+    def _conn(self):
+        # sqlite3 connections can't be shared across threads; Streamlit runs
+        # each session's script on its own thread.
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def import_reports(self, reports):
+        with self._conn() as conn:
+            conn.executemany(_UPSERT, [_report_to_row(r) for r in reports])
+            max_id = conn.execute("SELECT MAX(id) FROM reports").fetchone()[0]
+            if max_id:
+                conn.execute("INSERT OR IGNORE INTO report_ids (id) VALUES (?)", (max_id,))
+            conn.execute("DELETE FROM changes WHERE version <= (SELECT value FROM meta WHERE key = 'version') - ?",
+                         (CHANGE_LOG_SIZE,))
+        self.refresh()
+
+    def load(self):
+        return [_row_to_report(row) for row in self._conn().execute(f"{_SELECT} ORDER BY id")]
+
+    def next_id(self):
+        """Reserve a new report ID; IDs are never reused, even after a delete."""
+        with self._conn() as conn:
+            new_id = conn.execute("INSERT INTO report_ids DEFAULT VALUES").lastrowid
+            conn.execute("DELETE FROM report_ids WHERE id < ?", (new_id,))
+        return new_id
+
+    def put(self, report):
+        self._write(_UPSERT, _report_to_row(report), report['id'], report)
+
+    def delete(self, report_id):
+        self._write("DELETE FROM reports WHERE id = ?", (report_id,), report_id, None)
+
+    def get(self, report_id):
+        row = self._conn().execute(f"{_SELECT} WHERE id = ?", (report_id,)).fetchone()
+        return _row_to_report(row) if row else None
+
+    def latest(self):
+        row = self._conn().execute(f"{_SELECT} ORDER BY id DESC LIMIT 1").fetchone()
+        return _row_to_report(row) if row else None
+
+    def query(self, statuses=None, severities=None, primary_only=False):
+        """Reports matching the filters; ``primary_only`` hides reports merged into another incident."""
+        where, params = _where(statuses, severities, primary_only)
+        rows = self._conn().execute(f"{_SELECT}{where} ORDER BY id", params)
+        return [_row_to_report(row) for row in rows]
+
+    def incident_members(self, incident_id):
+        """Reports merged into ``incident_id`` (not including the incident's own report)."""
+        rows = self._conn().execute(
+            f"{_SELECT} WHERE incident_id = ? AND id != ? ORDER BY id", (incident_id, incident_id))
+        return [_row_to_report(row) for row in rows]
+
+    def page(self, statuses=None, severities=None, primary_only=False, order="newest",
+             offset=0, limit=20, near=None):
+        """One page of ``query()`` sorted by ``order`` (see ``PAGE_ORDERS``)."""
+        where, params = _where(statuses, severities, primary_only)
+        if order == "severity":
+            ranks = " ".join("WHEN ? THEN ?" for _ in SEVERITY_RANK)
+            order_by = f"CASE severity {ranks} ELSE {len(SEVERITY_RANK)} END, id DESC"
+            params = params + [v for item in SEVERITY_RANK.items() for v in item]
+        elif order == "distance" and near is not None:
+            order_by = "(lat - ?) * (lat - ?) + (lon - ?) * (lon - ?) * ?, id DESC"
+            params = params + [near[0], near[0], near[1], near[1], _lon_scale(near)]
+        else:
+            order_by = "id DESC"
+        rows = self._conn().execute(f"{_SELECT}{where} ORDER BY {order_by} LIMIT ? OFFSET ?",
+                                    params + [limit, offset])
+        return [_row_to_report(row) for row in rows]
+
+    def iter_query(self, statuses=None, severities=None, chunk_size=1000):
+        """``query()`` in ID order, yielded as lists of at most ``chunk_size`` reports."""
+        where, params = _where(statuses, severities)
+        last_id = None
+        while True:
+            # keyset pagination: each chunk is an index range scan, not an OFFSET skip
+            sql = (f"{_SELECT}{where}{' AND' if where else ' WHERE'} id > ? ORDER BY id LIMIT ?"
+                   if last_id is not None else f"{_SELECT}{where} ORDER BY id LIMIT ?")
+            args = params + ([last_id] if last_id is not None else []) + [chunk_size]
+            chunk = [_row_to_report(row) for row in self._conn().execute(sql, args)]
+            if not chunk:
+                return
+            yield chunk
+            last_id = chunk[-1]['id']
+
+    def count(self, statuses=None, severities=None, primary_only=False):
+        where, params = _where(statuses, severities, primary_only)
+        return self._memoized(
+            ('count', None if statuses is None else tuple(statuses),
+             None if severities is None else tuple(severities), primary_only),
+            lambda: self._conn().execute(f"SELECT COUNT(*) FROM reports{where}", params).fetchone()[0])
+
+    def count_by(self, field):
+        if field not in REPORT_FIELDS:
+            raise ValueError(f"Unknown report field: {field}")
+        return dict(self._memoized(
+            ('count_by', field),
+            lambda: self._conn().execute(f"SELECT {field}, COUNT(*) FROM reports GROUP BY {field}").fetchall()))
+
+
+def open_store(backend="json", path="data_reports.json"):
+    """Open the report store named by ``backend`` ("json" or "sqlite").
+
+    The SQLite database sits next to the JSON snapshot and is seeded from it the
+    first time it is opened.
+    """
+    if backend == "sqlite":
+        return SqliteStore(f"{os.path.splitext(path)[0]}.db", seed_from=path)
+    if backend == "json":
+        return JournalStore(path)
+    raise ValueError(f"Unknown storage backend: {backend}")
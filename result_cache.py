@@ -0,0 +1,162 @@
+"""Inference result cache and duplicate-photo index, keyed by image content.
+
+Results (counts, boxes and the plotted image) are stored under
+``sha256(image bytes) + conf + model tag`` in a small SQLite index with the
+plots saved as JPEGs next to it, so they survive restarts. The index is
+bounded: once it holds more than ``max_entries`` results the least recently
+used ones are evicted.
+
+The same database maps photo hashes to the report that first used them. Exact
+duplicates match on SHA-256; near duplicates (re-compressed, resized, slightly
+cropped) match on a 64-bit difference hash within ``NEAR_DUPLICATE_DISTANCE``
+bits. The dHash is split into eight 8-bit bands, each indexed: two hashes that
+differ in at most 7 bits must agree on at least one band, so candidates come
+from index lookups instead of a scan of every report.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import PIL.Image
+
+CACHE_DIR = ".inference_cache"
+MAX_ENTRIES = int(os.environ.get("INFERENCE_CACHE_ENTRIES", "1000"))
+NEAR_DUPLICATE_DISTANCE = 6
+_BANDS = 8
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    count INTEGER,
+    details TEXT,
+    boxes TEXT,
+    plot_file TEXT,
+    last_used REAL
+);
+CREATE INDEX IF NOT EXISTS idx_results_last_used ON results(last_used);
+CREATE TABLE IF NOT EXISTS photos (
+    report_id INTEGER PRIMARY KEY,
+    digest TEXT,
+    phash INTEGER,
+    b0 INTEGER, b1 INTEGER, b2 INTEGER, b3 INTEGER,
+    b4 INTEGER, b5 INTEGER, b6 INTEGER, b7 INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_photos_digest ON photos(digest);
+""" + "".join(f"CREATE INDEX IF NOT EXISTS idx_photos_b{i} ON photos(b{i});\n" for i in range(_BANDS))
+
+
+def image_digest(data):
+    return hashlib.sha256(bytes(data)).hexdigest()
+
+
+def perceptual_hash(image):
+    """64-bit difference hash: is each pixel brighter than its right neighbour?"""
+    small = image.convert("L").resize((9, 8), PIL.Image.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    # SQLite integers are signed 64-bit
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def _bands(phash):
+    unsigned = phash & ((1 << 64) - 1)
+    return [(unsigned >> (8 * i)) & 0xFF for i in range(_BANDS)]
+
+
+def hamming(a, b):
+    return bin((a ^ b) & ((1 << 64) - 1)).count("1")
+
+
+class ResultCache:
+    def __init__(self, path=CACHE_DIR, model_tag="", max_entries=MAX_ENTRIES):
+        self.path = path
+        self.model_tag = model_tag
+        self.max_entries = max_entries
+        self._local = threading.local()
+        os.makedirs(path, exist_ok=True)
+        with self._conn() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(os.path.join(self.path, "index.db"), timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _key(self, digest, conf):
+        return f"{digest}:{conf:.2f}:{self.model_tag}"
+
+    # --- inference results ---
+    def get(self, digest, conf):
+        """Cached ``{"count", "details", "boxes", "plotted"}`` or ``None``."""
+        key = self._key(digest, conf)
+        with self._conn() as conn:
+            row = conn.execute(
+                "SELECT count, details, boxes, plot_file FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+        plot_path = os.path.join(self.path, row[3])
+        return {
+            "count": row[0],
+            "details": json.loads(row[1]),
+            "boxes": json.loads(row[2]),
+            "plotted": PIL.Image.open(plot_path) if os.path.exists(plot_path) else None,
+        }
+
+    def put(self, digest, conf, count, details, boxes, plotted=None):
+        key = self._key(digest, conf)
+        plot_file = hashlib.sha1(key.encode()).hexdigest() + ".jpg"
+        if plotted is not None:
+            plotted.convert("RGB").save(os.path.join(self.path, plot_file), quality=85)
+        evicted = []
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)",
+                (key, count, json.dumps(details, ensure_ascii=False), json.dumps(boxes), plot_file, time.time()))
+            excess = conn.execute("SELECT COUNT(*) FROM results").fetchone()[0] - self.max_entries
+            if excess > 0:
+                evicted = conn.execute(
+                    "SELECT key, plot_file FROM results ORDER BY last_used LIMIT ?", (excess,)).fetchall()
+                conn.executemany("DELETE FROM results WHERE key = ?", [(k,) for k, _ in evicted])
+        for _, evicted_file in evicted:
+            try:
+                os.remove(os.path.join(self.path, evicted_file))
+            except FileNotFoundError:
+                pass
+
+    # --- duplicate photos ---
+    def find_duplicate(self, digest, phash, max_distance=NEAR_DUPLICATE_DISTANCE):
+        """Return ``(report_id, "exact" | "near")`` for an already reported photo, or ``None``."""
+        conn = self._conn()
+        row = conn.execute("SELECT report_id FROM photos WHERE digest = ? LIMIT 1", (digest,)).fetchone()
+        if row:
+            return row[0], "exact"
+        bands = _bands(phash)
+        candidates = conn.execute(
+            "SELECT report_id, phash FROM photos WHERE " + " OR ".join(f"b{i} = ?" for i in range(_BANDS)),
+            bands)
+        best = None
+        for report_id, other in candidates:
+            distance = hamming(phash, other)
+            if distance <= max_distance and (best is None or distance < best[1]):
+                best = (report_id, distance)
+        return (best[0], "near") if best else None
+
+    def register(self, report_id, digest, phash):
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO photos VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (report_id, digest, phash, *_bands(phash)))
+
+    def unregister(self, report_id):
+        with self._conn() as conn:
+            conn.execute("DELETE FROM photos WHERE report_id = ?", (report_id,))
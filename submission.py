@@ -0,0 +1,77 @@
+"""Turning an analysed photo into a saved report (used by the app and CLI tools)."""
+import io
+from datetime import datetime
+
+import PIL.Image
+
+from geo import find_incident
+from images import ingest_image, save_annotated
+from inference import severity_for
+from result_cache import image_digest, perceptual_hash
+
+IMG_DIR = 'uploaded_images'
+STATUS_PENDING = "รอรับเรื่อง"
+
+
+def create_report(store, image_data, lat, lon, count, details, note="", email="", img_dir=IMG_DIR,
+                  extra=None, annotated=None, spatial=None, conf=None):
+    """Save the photo, build a new report and put it in ``store``.
+
+    ``conf`` is the confidence threshold ``count``/``details`` were scored at
+    (kept so previews are drawn the same way). ``annotated`` is the plotted AI
+    result, if the caller already has it. With a
+    ``spatial`` index the report joins the open incident nearby (see
+    ``geo.find_incident``); otherwise it starts its own.
+    """
+    new_id = store.next_id()
+    incident_id = find_incident(spatial, lat, lon) if spatial is not None else None
+    save_path = ingest_image(image_data, new_id, img_dir)
+    if annotated is not None:
+        save_annotated(save_path, annotated)
+    new_report = {
+        "id": new_id,
+        "date": datetime.now().strftime("%Y-%m-%d %H:%M"),
+        "lat": lat, "lon": lon,
+        "count": count,
+        "details": details,
+        "severity": severity_for(count),
+        "note": note,
+        "email": email,
+        "status": STATUS_PENDING,
+        "image_path": save_path,
+        "incident_id": incident_id or new_id
+    }
+    if conf is not None:
+        new_report["conf"] = conf
+    if extra:
+        new_report.update(extra)
+    store.put(new_report)
+    return new_report
+
+
+def submit_photo(store, cache, image_data, lat, lon, count, details, note="", email="", img_dir=IMG_DIR,
+                 annotated=None, spatial=None, conf=None):
+    """``create_report()`` with duplicate-photo detection through ``cache``.
+
+    Returns ``(report, duplicate)`` where ``duplicate`` is ``None`` or
+    ``(report_id, "exact" | "near")``. An exact duplicate of an existing report's
+    photo returns that report and saves nothing; a near duplicate is saved with
+    ``duplicate_of`` pointing at the earlier report.
+    """
+    digest = image_digest(image_data)
+    phash = perceptual_hash(PIL.Image.open(io.BytesIO(bytes(image_data))))
+    duplicate = cache.find_duplicate(digest, phash)
+    if duplicate and duplicate[1] == "exact":
+        existing = store.get(duplicate[0])
+        if existing is not None:
+            return existing, duplicate
+        cache.unregister(duplicate[0])
+        duplicate = None
+
+    extra = {"image_sha256": digest, "image_phash": phash}
+    if duplicate:
+        extra["duplicate_of"] = duplicate[0]
+    report = create_report(store, image_data, lat, lon, count, details, note, email, img_dir, extra, annotated,
+                           spatial, conf)
+    cache.register(report['id'], digest, phash)
+    return report, duplicate
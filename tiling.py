@@ -0,0 +1,165 @@
+"""Sliced inference for high-resolution frames (drone / CCTV).
+
+A plain ``model(image)`` letterboxes the whole frame down to the model input
+size, so a bottle that is 20 px wide in a 4K shot ends up 3 px wide and is
+missed. ``predict_tiled`` instead cuts the frame into overlapping ``tile``-pixel
+crops, runs them through the model in batches at full resolution, shifts the
+boxes back into frame coordinates, optionally adds one downsized full-frame
+pass for objects larger than a tile, and merges the duplicates that the
+overlaps produce with class-wise greedy non-maximum merging.
+
+Boxes cut by an internal tile edge overlap their full-size twin only
+partially, so such a box is matched not only on IoU but also when most of it
+lies inside a higher-scoring tile box of the same class (intersection over the
+smaller box >= ``ios``), and the kept box grows to cover it, which rebuilds
+objects split across several tiles. Every other pair, including full-frame
+boxes against tile boxes, is matched on IoU only, so small debris lying inside
+a larger detection is kept.
+
+The merged result has the attributes the rest of the code reads from a YOLO
+result (``boxes.xyxy/cls/conf``, ``names``, ``speed``, ``plot()``).
+"""
+import time
+
+import numpy as np
+import PIL.Image
+import PIL.ImageDraw
+
+DEFAULT_TILE = 640
+DEFAULT_OVERLAP = 0.2
+NMS_IOU = 0.5
+NMS_IOS = 0.8
+# box edge within this many pixels of an internal tile edge = cut by the tile
+CUT_MARGIN = 2
+
+
+def _starts(length, tile, step):
+    if length <= tile:
+        return [0]
+    return list(range(0, length - tile, step)) + [length - tile]
+
+
+def tile_regions(width, height, tile=DEFAULT_TILE, overlap=DEFAULT_OVERLAP):
+    """``(left, top, right, bottom)`` crops covering the frame, ``overlap`` (0-1) shared between neighbours."""
+    step = max(1, int(tile * (1 - overlap)))
+    return [(x, y, min(x + tile, width), min(y + tile, height))
+            for y in _starts(height, tile, step) for x in _starts(width, tile, step)]
+
+
+def needs_tiling(image, tile):
+    return isinstance(image, PIL.Image.Image) and max(image.size) > tile
+
+
+def cut_by_tile(xyxy, region, width, height, margin=CUT_MARGIN):
+    """Which tile-local boxes (already in frame coordinates) touch an internal edge of ``region``."""
+    left, top, right, bottom = region
+    return (((xyxy[:, 0] <= left + margin) & (left > 0))
+            | ((xyxy[:, 1] <= top + margin) & (top > 0))
+            | ((xyxy[:, 2] >= right - margin) & (right < width))
+            | ((xyxy[:, 3] >= bottom - margin) & (bottom < height)))
+
+
+def merge_detections(xyxy, scores, classes, cut=None, full_frame=None, iou=NMS_IOU, ios=NMS_IOS):
+    """Class-wise greedy NMS/merge over frame-coordinate boxes; returns ``(xyxy, scores, classes)``.
+
+    ``cut`` flags tile boxes touching an internal tile edge and ``full_frame``
+    the boxes from the downsized full-frame pass (both default to all False).
+    Ties in score go to the larger box, so an uncut detection wins over the
+    piece of it seen by a neighbouring tile.
+    """
+    if len(scores) == 0:
+        return xyxy, scores, classes
+    cut = np.zeros(len(scores), dtype=bool) if cut is None else cut
+    full_frame = np.zeros(len(scores), dtype=bool) if full_frame is None else full_frame
+    areas = (xyxy[:, 2] - xyxy[:, 0]) * (xyxy[:, 3] - xyxy[:, 1])
+    suppressed = np.zeros(len(scores), dtype=bool)
+    keep, boxes = [], []
+    for i in np.lexsort((-areas, -scores)):
+        if suppressed[i]:
+            continue
+        ix = np.clip(np.minimum(xyxy[i, 2], xyxy[:, 2]) - np.maximum(xyxy[i, 0], xyxy[:, 0]), 0, None)
+        iy = np.clip(np.minimum(xyxy[i, 3], xyxy[:, 3]) - np.maximum(xyxy[i, 1], xyxy[:, 1]), 0, None)
+        inter = ix * iy
+        union = areas[i] + areas - inter
+        smaller = np.minimum(areas[i], areas)
+        same = (classes == classes[i]) & ~suppressed
+        # the contained (smaller) box of the pair must be a cut piece, and both must be tile boxes
+        smaller_cut = np.where(areas <= areas[i], cut, cut[i])
+        piece = smaller_cut & ~full_frame & ~full_frame[i]
+        merged = same & piece & (inter / np.where(smaller > 0, smaller, 1) >= ios)
+        matched = merged | (same & (inter / np.where(union > 0, union, 1) > iou))
+        matched[i] = merged[i] = True
+        box = np.concatenate([xyxy[merged, :2].min(axis=0), xyxy[merged, 2:].max(axis=0)])
+        suppressed |= matched
+        keep.append(i)
+        boxes.append(box)
+    keep = np.array(keep, dtype=int)
+    return np.array(boxes).reshape(-1, 4), scores[keep], classes[keep]
+
+
+class TiledBoxes:
+    def __init__(self, xyxy, cls, conf):
+        self.xyxy = xyxy
+        self.cls = cls
+        self.conf = conf
+
+
+class TiledResult:
+    """Merged detections for one frame, shaped like an ultralytics result."""
+
+    def __init__(self, image, xyxy, cls, conf, names, speed):
+        self.orig_image = image
+        self.boxes = TiledBoxes(xyxy, cls, conf)
+        self.names = names
+        self.speed = speed
+
+    def plot(self):
+        """Annotated frame as a BGR array, like ``Results.plot()``."""
+        image = self.orig_image.convert("RGB")
+        draw = PIL.ImageDraw.Draw(image)
+        width = max(2, max(image.size) // 500)
+        for (x0, y0, x1, y1), c, s in zip(self.boxes.xyxy.tolist(), self.boxes.cls.tolist(), self.boxes.conf.tolist()):
+            draw.rectangle((x0, y0, x1, y1), outline=(255, 56, 56), width=width)
+            draw.text((x0 + width, max(0, y0 - 12)), f"{self.names.get(int(c), c)} {s:.2f}", fill=(255, 56, 56))
+        return np.asarray(image)[..., ::-1]
+
+
+def predict_tiled(model, image, conf, tile=DEFAULT_TILE, overlap=DEFAULT_OVERLAP, batch_size=8,
+                  full_frame=True):
+    """Detections for one PIL ``image`` from overlapping ``tile``-pixel crops (see module docstring)."""
+    started = time.perf_counter()
+    image = image.convert("RGB")
+    regions = tile_regions(image.size[0], image.size[1], tile, overlap)
+    crops = [image.crop(region) for region in regions]
+    prepared = time.perf_counter()
+
+    width, height = image.size
+    xyxy, cls, scores, cut, names = [], [], [], [], {}
+    for start in range(0, len(crops), batch_size):
+        batch_regions = regions[start:start + batch_size]
+        for region, result in zip(batch_regions, model(crops[start:start + batch_size], conf=conf,
+                                                       imgsz=tile, verbose=False)):
+            left, top = region[:2]
+            names = result.names
+            boxes = np.array(result.boxes.xyxy.tolist(), dtype=float).reshape(-1, 4) + [left, top, left, top]
+            xyxy.extend(boxes.tolist())
+            cut.extend(cut_by_tile(boxes, region, width, height).tolist())
+            cls.extend(result.boxes.cls.tolist())
+            scores.extend(result.boxes.conf.tolist())
+    tiled = len(xyxy)
+    if full_frame and len(regions) > 1:
+        result = model(image, conf=conf, verbose=False)[0]
+        names = result.names
+        xyxy.extend(result.boxes.xyxy.tolist())
+        cls.extend(result.boxes.cls.tolist())
+        scores.extend(result.boxes.conf.tolist())
+    inferred = time.perf_counter()
+
+    xyxy = np.array(xyxy, dtype=float).reshape(-1, 4)
+    cls, scores = np.array(cls, dtype=float), np.array(scores, dtype=float)
+    cut = np.array(cut + [False] * (len(scores) - tiled), dtype=bool)
+    full = np.arange(len(scores)) >= tiled
+    xyxy, scores, cls = merge_detections(xyxy, scores, cls, cut=cut, full_frame=full)
+    speed = {"preprocess": (prepared - started) * 1000, "inference": (inferred - prepared) * 1000,
+             "postprocess": (time.perf_counter() - inferred) * 1000}
+    return TiledResult(image, xyxy, cls, scores, names, speed)